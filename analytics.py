@@ -0,0 +1,80 @@
+"""Cross-month trends read from the daily rollups and per-month balances.
+
+Every query here touches at most one row per day (or per user per month),
+never the raw meal and bazar entries, so multi-year ranges stay fast. All
+of them cover one mess: the rollups carry it, balances join it in through
+the month.
+"""
+from datetime import timedelta
+
+from models import db, Month, DailyRollup, UserMonthBalance
+from ledger import get_roster
+
+
+def _in_range(query, mess_id, start, end):
+    query = query.filter(DailyRollup.mess_id == mess_id)
+    if start is not None:
+        query = query.filter(DailyRollup.day >= start)
+    if end is not None:
+        query = query.filter(DailyRollup.day <= end)
+    return query
+
+
+# [{date, meals}] for each day with meals
+def meals_per_day(mess_id, start=None, end=None):
+    rows = _in_range(db.session.query(DailyRollup.day, db.func.sum(DailyRollup.meals)), mess_id, start, end) \
+        .group_by(DailyRollup.day).order_by(DailyRollup.day)
+    return [{'date': day.isoformat(), 'meals': meals} for day, meals in rows if meals]
+
+
+# [{week, bazar}] with weeks starting on Monday
+def bazar_per_week(mess_id, start=None, end=None):
+    rows = _in_range(db.session.query(DailyRollup.day, db.func.sum(DailyRollup.bazar)), mess_id, start, end) \
+        .group_by(DailyRollup.day).order_by(DailyRollup.day)
+    weeks = {}
+    for day, bazar in rows:
+        if bazar:
+            week = day - timedelta(days=day.weekday())
+            weeks[week] = weeks.get(week, 0) + bazar
+    return [{'week': week.isoformat(), 'bazar': float(bazar)} for week, bazar in weeks.items()]
+
+
+def _months_in_range(query, mess_id, start, end):
+    if start is not None or end is not None:
+        month_ids = _in_range(db.session.query(DailyRollup.month_id).distinct(), mess_id, start, end)
+        return query.filter(UserMonthBalance.month_id.in_(month_ids))
+    mess_months = db.session.query(Month.id).filter(Month.mess_id == mess_id)
+    return query.filter(UserMonthBalance.month_id.in_(mess_months))
+
+
+def _user(roster, user_id, **fields):
+    known = roster.get(user_id)
+    return {'id': user_id, 'name': known.name if known else None,
+            'role': known.role if known else None, **fields}
+
+
+# Every user's meals and deposits summed over the months with meals or bazar
+# in the range (every month when there is no range), one row per user:
+# [{id, name, role, total_meals, deposit, months}] where months is a count.
+def user_consumption(mess_id, start=None, end=None):
+    rows = _months_in_range(db.session.query(
+        UserMonthBalance.user_id, db.func.sum(UserMonthBalance.total_meal),
+        db.func.sum(UserMonthBalance.deposit), db.func.count(UserMonthBalance.month_id)), mess_id, start, end) \
+        .group_by(UserMonthBalance.user_id).order_by(UserMonthBalance.user_id)
+    roster = get_roster(mess_id).by_id
+    return [_user(roster, uid, total_meals=meals, deposit=float(deposit), months=months)
+            for uid, meals, deposit, months in rows]
+
+
+# One user's meals and deposits month by month, over the same months:
+# {id, name, role, total_meals, deposit, months: [{id, name, meals, deposit}]}
+def user_months(mess_id, user_id, start=None, end=None):
+    rows = _months_in_range(db.session.query(
+        Month.id, Month.name, UserMonthBalance.total_meal, UserMonthBalance.deposit)
+        .join(Month, Month.id == UserMonthBalance.month_id)
+        .filter(UserMonthBalance.user_id == user_id), mess_id, start, end).order_by(Month.id).all()
+    return _user(get_roster(mess_id).by_id, user_id,
+                 total_meals=sum(meals for _, _, meals, _ in rows),
+                 deposit=float(sum(deposit for *_, deposit in rows)),
+                 months=[{'id': month_id, 'name': name, 'meals': meals, 'deposit': float(deposit)}
+                         for month_id, name, meals, deposit in rows])
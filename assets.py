@@ -0,0 +1,126 @@
+"""Fingerprinted static files and compressed responses.
+
+url_for('static', filename='offline.js') gives /static/offline.<hash>.js,
+where the hash comes from the file's contents. Those URLs are served with a
+one-year immutable Cache-Control, so browsers never revalidate them, and a
+changed file gets a new URL. Unhashed names still work with the default
+caching.
+
+HTML, JSON, CSS and JavaScript responses of at least COMPRESS_MIN_SIZE
+bytes are gzip-compressed when the client accepts it, or brotli-compressed
+if the optional `brotli` package is installed and the client accepts br.
+Streamed responses (the exports) are left alone.
+"""
+import gzip
+import hashlib
+import os
+
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = {'text/html', 'text/css', 'text/javascript', 'text/plain', 'application/json',
+                'application/manifest+json', 'image/svg+xml'}
+
+
+# ---------------- FINGERPRINTS ----------------
+class StaticAssets:
+    def __init__(self):
+        self._hashed = None     # file name -> fingerprinted name
+        self._originals = None  # fingerprinted name -> file name
+        self._version = None
+
+    def init_app(self, app):
+        app.extensions['assets'] = self
+        app.url_defaults(self._fingerprint_url)
+        app.view_functions['static'] = self._serve
+
+    # Hash every file under static/ once per process (on every call in debug
+    # mode, so edits show up without a restart)
+    def _load(self):
+        if self._hashed is not None and not current_app.debug:
+            return
+        folder = current_app.static_folder
+        hashed, digest = {}, hashlib.sha256()
+        for root, _, files in os.walk(folder):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                name = os.path.relpath(path, folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    file_hash = hashlib.sha256(f.read()).hexdigest()[:12]
+                stem, ext = os.path.splitext(name)
+                hashed[name] = f'{stem}.{file_hash}{ext}'
+        for name in sorted(hashed):
+            digest.update(f'{hashed[name]};'.encode())
+        self._hashed = hashed
+        self._originals = {v: k for k, v in hashed.items()}
+        self._version = digest.hexdigest()[:12]
+
+    def files(self):
+        self._load()
+        return sorted(self._hashed)
+
+    # Changes whenever any static file does (names the service worker cache)
+    def version(self):
+        self._load()
+        return self._version
+
+    def _fingerprint_url(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            self._load()
+            values['filename'] = self._hashed.get(values['filename'], values['filename'])
+
+    def _serve(self, filename):
+        self._load()
+        original = self._originals.get(filename)
+        response = send_from_directory(current_app.static_folder, original or filename)
+        if original is not None:
+            response.headers['Cache-Control'] = IMMUTABLE
+        if response.mimetype in COMPRESSIBLE:
+            # read the file into the body so compress_response can see it
+            response.direct_passthrough = False
+            response.make_sequence()
+        return response
+
+
+# ---------------- COMPRESSION ----------------
+def _encoding():
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+# after_request hook. Compressed responses get a weak ETag: the body
+# differs from the uncompressed one, but it is the same resource. Partial
+# (Range) responses are left alone, their Content-Range counts raw bytes.
+def compress_response(response):
+    min_size = current_app.config['COMPRESS_MIN_SIZE']
+    if (not min_size or request.method == 'HEAD' or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Range' in response.headers
+            or response.mimetype not in COMPRESSIBLE or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+
+    level = current_app.config['COMPRESS_LEVEL']
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=min(level, 11)))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=level, mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,91 @@
+"""Password hashing policy and the per-request user loader.
+
+Every password is hashed with PASSWORD_HASH_METHOD. Hashes made with any
+other method (older defaults, or a policy that has since changed) still
+verify, and are replaced with the current method the next time their owner
+logs in, while the plain password is at hand.
+
+Flask-Login loads the user on every request. Instead of reading the whole
+user row, login stamps the session (a signed cookie) with the user's id,
+name, role and mess plus that mess's roster version; while the version is
+current the user is rebuilt from the cookie without a query. Adding,
+editing or deleting a user bumps the version, so the next request re-reads
+the roster and re-stamps it (other workers within USER_CACHE_TTL seconds).
+"""
+from functools import lru_cache
+
+from flask import current_app, session
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from models import db, User
+from ledger import get_roster, cached_roster_version
+
+
+# ---------------- HASHING ----------------
+def hash_password(password):
+    return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+
+# The "method:params" prefix werkzeug writes for a policy, e.g. "scrypt"
+# -> "scrypt:32768:8:1". Found by hashing once per process.
+@lru_cache(maxsize=None)
+def _hash_prefix(method):
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+def needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _hash_prefix(current_app.config['PASSWORD_HASH_METHOD'])
+
+
+# The user with these credentials, or None. A hash made with another method
+# is upgraded to the current policy (the caller commits).
+def authenticate(username, password):
+    user = User.query.filter_by(username=username).first()
+    if user is None or not user.password or not check_password_hash(user.password, password):
+        return None
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+    return user
+
+
+# ---------------- SESSION USER ----------------
+class SessionUser(UserMixin):
+    """The logged-in user as routes see it: id, name, role and mess, no DB row."""
+
+    def __init__(self, id, name, role, mess_id):
+        self.id, self.name, self.role, self.mess_id = id, name, role, mess_id
+
+
+# Call at login with the authenticated User row
+def remember_user(user):
+    _stamp(SessionUser(user.id, user.name, user.role, user.mess_id), cached_roster_version(user.mess_id))
+
+
+def _stamp(user, version):
+    session['user'] = [user.id, user.name, user.role, user.mess_id, version]
+
+
+def forget_user():
+    session.pop('user', None)
+
+
+# Flask-Login user_loader: no query while the worker's copy of the mess's
+# roster version is fresh and matches the session
+def load_user(user_id):
+    user_id = int(user_id)
+    cached = session.get('user')
+    if cached and len(cached) == 5 and cached[0] == user_id and cached[4] == cached_roster_version(cached[3]):
+        return SessionUser(*cached[:4])
+    mess_id = db.session.query(User.mess_id).filter_by(id=user_id).scalar()
+    if mess_id is None:
+        forget_user()
+        return None
+    roster = get_roster(mess_id)
+    user = roster.by_id.get(user_id)
+    if user is None:
+        forget_user()
+        return None
+    session_user = SessionUser(user.id, user.name, user.role, mess_id)
+    _stamp(session_user, roster.version)
+    return session_user
@@ -0,0 +1,438 @@
+"""Micro-benchmarks for the ledger queries and bulk writes.
+
+Runs against a throwaway SQLite file unless DATABASE_URL is set. Every run
+reseeds its database, so a configured DATABASE_URL is only used with --yes:
+
+    python bench.py
+    DATABASE_URL=postgresql://localhost/bench python bench.py --yes --users 200 --days 150
+"""
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+THROWAWAY_DB = 'DATABASE_URL' not in os.environ
+if THROWAWAY_DB:
+    _tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + _tmp.name
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import create_app
+from auth import hash_password, load_user, remember_user
+from gen_data import generate
+from ledger import (month_summary, user_balances, update_ledger, save_day_meals, rebuild_month_summary,
+                    get_roster, invalidate_roster, compute_balances)
+from models import db, DEFAULT_MESS_ID, Mess, User, Month, Meal, Deposit, Bazar, LedgerEvent
+from analytics import meals_per_day, bazar_per_week, user_consumption
+from events import LEDGER_KINDS, ledger_at, utcnow
+
+app = create_app()
+# set by --yes: the configured DATABASE_URL may be wiped
+wipe_confirmed = False
+
+
+# ---------------- DATA ----------------
+# gen_data.generate() drops every table first, so it only runs on the
+# throwaway database or after --yes
+def reseed(*args, **kwargs):
+    if not (THROWAWAY_DB or wipe_confirmed):
+        sys.exit(f'bench.py deletes all data in {db.engine.url!r}; pass --yes to run it there')
+    return generate(*args, **kwargs)
+
+
+# One month in which every user eats every day; returns the month id.
+# Every user's password is "bench".
+def seed(users, days):
+    reseed(users, months=1, days=days, attendance=1.0)
+    return db.session.query(Month.id).scalar()
+
+
+# ---------------- DASHBOARD ----------------
+# The pre-aggregation manager_dashboard body, kept here for comparison
+def legacy_dashboard(month_id):
+    bazars = Bazar.query.filter_by(month_id=month_id).all()
+    deposits = Deposit.query.filter_by(month_id=month_id).all()
+    meals = Meal.query.filter_by(month_id=month_id).all()
+
+    total_bazar = sum(b.cost for b in bazars)
+    total_meals = sum(m.morning + m.lunch + m.dinner for m in meals)
+    meal_rate = round(total_bazar / total_meals, 2) if total_meals > 0 else 0
+
+    stats = []
+    for u in User.query.all():
+        u_meals = [m for m in meals if m.user_id == u.id]
+        u_deposits = [d for d in deposits if d.boarder_id == u.id]
+        total_meal_count = sum(m.morning + m.lunch + m.dinner for m in u_meals)
+        total_deposit = sum(d.amount for d in u_deposits)
+        meal_cost = round(total_meal_count * meal_rate, 2)
+        stats.append((u.id, total_meal_count, total_deposit, meal_cost,
+                      round(total_deposit - meal_cost, 2)))
+    return total_bazar, total_meals, sorted(stats)
+
+
+def summary_dashboard(month_id):
+    summary = month_summary(month_id)
+    users = user_balances(month_id, DEFAULT_MESS_ID)
+    costs, balances = compute_balances(summary.total_bazar, [u.total_meal for u in users],
+                                       [u.deposit for u in users])
+    stats = [(u.id, u.total_meal, u.deposit, cost, balance)
+             for u, cost, balance in zip(users, costs, balances)]
+    return summary.total_bazar, summary.total_meals, stats
+
+
+def timed(fn, *args, repeat=5):
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_dashboard(month_id, repeat):
+    legacy_time, legacy = timed(legacy_dashboard, month_id, repeat=repeat)
+    summary_time, summary = timed(summary_dashboard, month_id, repeat=repeat)
+    assert legacy[1] == summary[1], 'total meals differ'
+    assert abs(legacy[0] - summary[0]) < 0.01, 'total bazar differs'
+    assert [s[:2] for s in legacy[2]] == [s[:2] for s in summary[2]], 'per-user meals differ'
+    assert all(abs(a[2] - b[2]) < 0.01 for a, b in zip(legacy[2], summary[2])), 'deposits differ'
+
+    print(f'manager_dashboard  legacy {legacy_time * 1000:8.1f} ms   '
+          f'summary {summary_time * 1000:8.1f} ms')
+
+
+# ---------------- BALANCES ----------------
+# Cost/balance math alone on synthetic rosters: the old per-user float
+# rounding versus compute_balances' single pass over whole-cent lists.
+# Also reports how far each one's meal costs drift from the bazar total.
+def legacy_balances(total_bazar, meals, deposits):
+    total_meals = sum(meals)
+    meal_rate = round(float(total_bazar) / total_meals, 2) if total_meals > 0 else 0
+    costs, balances = [], []
+    for total_meal, deposit in zip(meals, deposits):
+        meal_cost = round(total_meal * meal_rate, 2)
+        costs.append(meal_cost)
+        balances.append(round(float(deposit) - meal_cost, 2))
+    return costs, balances
+
+
+def bench_balances(sizes=(1000, 10000, 100000), repeat=5):
+    rng = random.Random(7)
+    for users in sizes:
+        meals = [rng.randint(0, 90) for _ in range(users)]
+        deposits = [Decimal(rng.randint(500, 4000)) + Decimal(rng.randint(0, 99)) / 100 for _ in range(users)]
+        total_bazar = Decimal(rng.randint(30, 60) * users) + Decimal('0.37')
+        times = {}
+        for name, fn in (('legacy', legacy_balances), ('batched', compute_balances)):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                costs, _ = fn(total_bazar, meals, deposits)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            drift = Decimal(str(round(sum(costs), 2))) - total_bazar
+            times[name] = (best, drift)
+        assert times['batched'][1] == 0, 'meal costs do not add up to total bazar'
+        print(f'balances {users:7d} users  legacy {times["legacy"][0] * 1000:7.1f} ms '
+              f'(drift {times["legacy"][1]:+10.2f})   batched {times["batched"][0] * 1000:7.1f} ms '
+              f'(drift {times["batched"][1]:+.2f})')
+
+
+# ---------------- BOARDER DASHBOARD ----------------
+# Median boarder_dashboard latency as the roster grows; it should stay flat.
+def bench_boarder_scaling(days, sizes=(50, 200, 800), requests=30):
+    for users in sizes:
+        seed(users, days)
+        client = app.test_client()
+        client.post('/login', data={'username': 'user1', 'password': 'bench'})
+        assert client.get('/boarder/dashboard').status_code == 200
+
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            client.get('/boarder/dashboard')
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        print(f'boarder_dashboard  {users:5d} users  {users * days:7d} meals  '
+              f'median {samples[len(samples) // 2] * 1000:6.2f} ms')
+
+
+# ---------------- BULK MEALS ----------------
+# One day's meals for every user: add_meal's one-row-per-commit path versus
+# the single-transaction save_day_meals used by the daily grid.
+def bench_bulk_meals(month_id):
+    user_ids = [uid for (uid,) in db.session.query(User.id)]
+    month_summary(month_id)
+
+    started = time.perf_counter()
+    day = date(2030, 1, 1)
+    for uid in user_ids:
+        db.session.add(Meal(date=day, user_id=uid, month_id=month_id, morning=1, lunch=1, dinner=1))
+        update_ledger('meal', month_id, uid, meals=3, day=day)
+        db.session.commit()
+    per_row = time.perf_counter() - started
+
+    started = time.perf_counter()
+    save_day_meals(month_id, date(2030, 1, 2), {uid: (1, 1, 1) for uid in user_ids})
+    bulk = time.perf_counter() - started
+
+    started = time.perf_counter()
+    save_day_meals(month_id, date(2030, 1, 2), {uid: (0, 2, 1) for uid in user_ids})
+    bulk_update = time.perf_counter() - started
+
+    assert not rebuild_month_summary(month_id), 'ledger drifted during bulk entry'
+    db.session.rollback()
+    n = len(user_ids)
+    print(f'day of meals       per-row {n / per_row:8.0f} rows/s   '
+          f'bulk insert {n / bulk:8.0f} rows/s   bulk update {n / bulk_update:8.0f} rows/s')
+
+
+# ---------------- ROSTER ----------------
+# The user dropdown on add_meal / add_deposit: full User rows on every
+# request versus the cached roster, which only re-reads its version row.
+def bench_roster(repeat=200):
+    def timed(fn):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+            db.session.rollback()
+        return (time.perf_counter() - started) / repeat
+
+    full = timed(lambda: User.query.all())
+    invalidate_roster(DEFAULT_MESS_ID)
+    db.session.commit()
+    cold = timed(lambda: (invalidate_roster(DEFAULT_MESS_ID), get_roster(DEFAULT_MESS_ID)))
+    warm = timed(lambda: get_roster(DEFAULT_MESS_ID))
+    print(f'user dropdown      User.query.all {full * 1000:7.2f} ms   '
+          f'roster reload {cold * 1000:7.2f} ms   roster cached {warm * 1000:7.2f} ms')
+
+
+# ---------------- ANALYTICS ----------------
+# /api/analytics over a multi-year archive: GROUP BY over the raw meal and
+# bazar rows versus the daily rollups. Reseeds the database, so it runs last.
+def raw_analytics():
+    meals = db.session.query(Meal.date, db.func.sum(Meal.morning + Meal.lunch + Meal.dinner)) \
+        .group_by(Meal.date).order_by(Meal.date).all()
+    bazar = db.session.query(Bazar.date, db.func.sum(Bazar.cost)).group_by(Bazar.date).all()
+    users = db.session.query(Meal.user_id, Meal.month_id, db.func.sum(Meal.morning + Meal.lunch + Meal.dinner)) \
+        .group_by(Meal.user_id, Meal.month_id).all()
+    return [{'date': day.isoformat(), 'meals': n} for day, n in meals if n], bazar, users
+
+
+def rollup_analytics():
+    return (meals_per_day(DEFAULT_MESS_ID), bazar_per_week(DEFAULT_MESS_ID),
+            user_consumption(DEFAULT_MESS_ID))
+
+
+def bench_analytics(users, months, repeat):
+    counts = reseed(users, months)
+    raw_time, raw = timed(raw_analytics, repeat=repeat)
+    rollup_time, rollup = timed(rollup_analytics, repeat=repeat)
+    assert raw[0] == rollup[0], 'meals per day differ'
+    assert abs(sum(c for _, c in raw[1]) - sum(Decimal(str(w['bazar'])) for w in rollup[1])) < 1, 'bazar differs'
+    assert sum(n for *_, n in raw[2]) == sum(u['total_meals'] for u in rollup[2]), 'user meals differ'
+    print(f'analytics ({counts["meals"]} meals, {months} months)   '
+          f'raw GROUP BY {raw_time * 1000:8.1f} ms   rollups {rollup_time * 1000:8.1f} ms')
+
+
+# ---------------- LOGIN ----------------
+# Password checks per second on one core for each hash method (a login is
+# one check), then the per-request user load: the full User row versus the
+# session payload, which only re-reads the roster version row.
+def bench_login(methods=('pbkdf2:sha256', 'scrypt', 'scrypt:16384:8:1'), repeat=3, requests=500):
+    for method in methods:
+        password_hash = generate_password_hash('bench', method=method)
+        started = time.perf_counter()
+        for _ in range(repeat):
+            check_password_hash(password_hash, 'bench')
+        per_login = (time.perf_counter() - started) / repeat
+        print(f'login  {password_hash.split("$")[0]:24} {per_login * 1000:7.1f} ms   {1 / per_login:6.1f} logins/s per worker')
+
+    user = db.session.query(User).filter_by(username='user0').one()
+    with app.test_request_context():
+        remember_user(user)
+
+        def timed(fn):
+            started = time.perf_counter()
+            for _ in range(requests):
+                fn()
+                db.session.expunge_all()
+            return (time.perf_counter() - started) / requests
+
+        row = timed(lambda: db.session.get(User, user.id))
+        cached = timed(lambda: load_user(str(user.id)))
+    print(f'user loader        User row {row * 1000:7.3f} ms   session payload {cached * 1000:7.3f} ms')
+
+
+# ---------------- TRANSFER ----------------
+# Bytes a browser downloads per page load: the page plus its static files,
+# uncompressed versus gzip. On a repeat visit the old unhashed static URLs
+# were revalidated every time; fingerprinted ones are immutable and not
+# requested at all. Bootstrap comes from the CDN and is not counted.
+def bench_transfer(pages=('/manager/dashboard', '/manager/view_meals', '/api/balances')):
+    client = app.test_client()
+    client.post('/login', data={'username': 'user0', 'password': 'bench'})
+    gzip_header = {'Accept-Encoding': 'gzip'}
+    for path in pages:
+        plain = client.get(path)
+        compressed = client.get(path, headers=gzip_header)
+        assets = re.findall(r'(?:src|href)="(/static/[^"]+)"', plain.get_data(as_text=True))
+        asset_plain = sum(len(client.get(a).data) for a in assets)
+        asset_compressed = sum(len(client.get(a, headers=gzip_header).data) for a in assets)
+        before = len(plain.data) + asset_plain
+        after = len(compressed.data) + asset_compressed
+        print(f'transfer  {path:20} before {before:8d} B   after {after:8d} B ({after / before:6.1%})   '
+              f'static requests on repeat visit {len(assets)} -> 0')
+
+
+# ---------------- EVENTS ----------------
+# A month's balances at a point in time: its nearest checkpoint plus the
+# events after it, versus summing its whole event log. First adds `events`
+# single meals (one event each, 100 per commit) to the seeded month.
+def replay_from_zero(month_id, when):
+    return db.session.query(
+        LedgerEvent.user_id, db.func.sum(LedgerEvent.meals), db.func.sum(LedgerEvent.deposit),
+        db.func.sum(LedgerEvent.bazar),
+    ).filter(LedgerEvent.month_id == month_id, LedgerEvent.at <= when,
+             LedgerEvent.kind.in_(LEDGER_KINDS)).group_by(LedgerEvent.user_id).all()
+
+
+def bench_events(month_id, events, repeat):
+    user_ids = [uid for (uid,) in db.session.query(User.id).filter_by(mess_id=DEFAULT_MESS_ID)]
+    first_day = date(2031, 1, 1)
+    for n in range(events):
+        day, uid = first_day + timedelta(days=n // len(user_ids)), user_ids[n % len(user_ids)]
+        db.session.add(Meal(date=day, user_id=uid, month_id=month_id, morning=1, lunch=0, dinner=0))
+        update_ledger('meal', month_id, uid, meals=1, day=day)
+        if n % 100 == 99:
+            db.session.commit()
+    db.session.commit()
+
+    logged = LedgerEvent.query.filter_by(month_id=month_id).count()
+    when = utcnow()
+    full_time, rows = timed(replay_from_zero, month_id, when, repeat=repeat)
+    checkpoint_time, state = timed(ledger_at, month_id, when, repeat=repeat)
+    summary = month_summary(month_id)
+    assert sum(meals or 0 for _, meals, _, _ in rows) == state.total_meals == summary.total_meals, \
+        'replayed meals differ from the summary'
+    print(f'balances at a time ({logged} events)   full replay {full_time * 1000:7.2f} ms   '
+          f'checkpoint + replay {checkpoint_time * 1000:7.2f} ms')
+
+
+# ---------------- TENANTS ----------------
+# A small mess next to the seeded large one. Everything is keyed by mess
+# (or by month) first, so its dashboard should cost the same as if it were
+# alone, however big the other mess is.
+def add_small_mess(users=10, days=30):
+    mess = Mess(name='Small Mess')
+    db.session.add(mess)
+    db.session.flush()
+    password = hash_password('bench')
+    db.session.execute(User.__table__.insert(), [
+        {'mess_id': mess.id, 'name': f'Small {i}', 'username': f'small{i}', 'password': password,
+         'role': 'manager' if i == 0 else 'boarder', 'first_login': False}
+        for i in range(users)
+    ])
+    month = Month(mess_id=mess.id, name='Small Month', is_active=True)
+    db.session.add(month)
+    db.session.flush()
+    user_ids = [uid for (uid,) in db.session.query(User.id).filter_by(mess_id=mess.id)]
+    db.session.execute(Meal.__table__.insert(), [
+        {'date': date(2030, 1, 1 + d), 'user_id': uid, 'month_id': month.id, 'morning': 1, 'lunch': 1,
+         'dinner': 1}
+        for d in range(days) for uid in user_ids
+    ])
+    db.session.execute(Bazar.__table__.insert(), [
+        {'date': date(2030, 1, 1 + d), 'month_id': month.id, 'description': 'Rice', 'cost': 500}
+        for d in range(days)
+    ])
+    rebuild_month_summary(month.id)
+    invalidate_roster(mess.id)
+    db.session.commit()
+    return mess.id
+
+
+def bench_tenants(requests=30):
+    add_small_mess()
+    medians = {}
+    for username in ('user0', 'small0'):
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': 'bench'})
+        assert client.get('/manager/dashboard').status_code == 200
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            client.get('/manager/dashboard')
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        medians[username] = samples[len(samples) // 2]
+    large = db.session.query(User.id).filter_by(mess_id=DEFAULT_MESS_ID).count()
+    print(f'manager_dashboard  large mess ({large} users) {medians["user0"] * 1000:6.2f} ms   '
+          f'small mess (10 users) {medians["small0"] * 1000:6.2f} ms')
+
+
+# ---------------- STARTUP ----------------
+# Median wall time of a fresh interpreter importing each module: what a
+# gunicorn worker (wsgi) or a script that only needs the models pays before
+# serving anything.
+def bench_startup(runs=5):
+    for statement in ('import models', 'import app', 'import wsgi'):
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', statement], check=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            samples.append(time.perf_counter() - started)
+        samples.sort()
+        print(f'startup  {statement:14} median {samples[len(samples) // 2] * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--days', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--yes', action='store_true', help='allow wiping the database DATABASE_URL points at')
+    parser.add_argument('--boarders', action='store_true', help='time boarder_dashboard across roster sizes')
+    parser.add_argument('--startup', action='store_true', help='time importing the app in a fresh interpreter')
+    parser.add_argument('--transfer', action='store_true', help='bytes per page load, uncompressed vs gzip')
+    parser.add_argument('--events', type=int, metavar='N',
+                        help='log N more meal events and time point-in-time balances')
+    parser.add_argument('--tenants', action='store_true', help='time a small mess dashboard next to the seeded one')
+    parser.add_argument('--login', action='store_true', help='time password checks per hash method and user loading')
+    parser.add_argument('--analytics', type=int, metavar='MONTHS',
+                        help='reseed with this many months and time /api/analytics raw vs rollups')
+    args = parser.parse_args()
+    wipe_confirmed = args.yes
+
+    if args.startup:
+        bench_startup()
+
+    with app.app_context():
+        month_id = seed(args.users, args.days)
+        print(f'{args.users} users, {Meal.query.count()} meals on {db.engine.url.drivername}')
+        bench_dashboard(month_id, args.repeat)
+        bench_balances()
+        bench_bulk_meals(month_id)
+        bench_roster()
+        if args.boarders:
+            bench_boarder_scaling(args.days)
+        if args.transfer:
+            bench_transfer()
+        if args.login:
+            bench_login()
+        if args.events:
+            bench_events(month_id, args.events, args.repeat)
+        if args.tenants:
+            bench_tenants()
+        if args.analytics:
+            bench_analytics(args.users, args.analytics, args.repeat)
@@ -0,0 +1,127 @@
+"""Month close: freeze a finished month into an immutable report.
+
+Starting a new month (or disabling one) queues a MonthClose row in the same
+transaction and hands the month to a small in-process thread pool, so the
+manager's request returns straight away. A worker that dies mid-close
+leaves the row pending or running; `flask --app app close-months` finishes
+those and backfills months that ended before snapshots existed.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from models import db, Month, MonthClose, MonthCloseBalance, MonthSummary
+from ledger import ZERO, get_roster, month_totals, raw_user_totals, meal_rate, compute_balances
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------- QUEUE ----------------
+# Mark months as waiting to be closed. Call before committing the change
+# that ends them; run_month_closes() once it is committed.
+def queue_month_close(month_ids):
+    for month_id in month_ids:
+        close = db.session.get(MonthClose, month_id)
+        if close is None:
+            db.session.add(MonthClose(month_id=month_id, status='pending', requested_at=_utcnow()))
+        elif close.status == 'failed':
+            close.status, close.error = 'pending', None
+
+
+# Close months on the background pool, or inline when MONTH_CLOSE_WORKERS is 0
+def run_month_closes(month_ids):
+    app = current_app._get_current_object()
+    workers = app.config['MONTH_CLOSE_WORKERS']
+    if not workers:
+        for month_id in month_ids:
+            close_month(month_id)
+        return
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='month-close')
+    for month_id in month_ids:
+        _executor.submit(_close_in_background, app, month_id)
+
+
+def _close_in_background(app, month_id):
+    with app.app_context():
+        try:
+            close_month(month_id)
+        except Exception:
+            app.logger.exception("Closing month %s failed", month_id)
+
+
+# ---------------- CLOSE ----------------
+# Build the snapshot from the raw rows: totals, meal rate, and every user's
+# balance plus what carries forward from the previous closed month.
+# Returns the MonthClose row; closed months are left untouched, and so are
+# ones another worker is closing unless `force` is set.
+def close_month(month_id, force=False):
+    close = db.session.get(MonthClose, month_id)
+    if close is None:
+        close = MonthClose(month_id=month_id, requested_at=_utcnow())
+        db.session.add(close)
+    elif close.status == 'done' or (close.status == 'running' and not force):
+        return close
+    close.status = 'running'
+    db.session.commit()
+
+    try:
+        summary = db.session.get(MonthSummary, month_id)
+        total_bazar, total_meals = month_totals(month_id)
+        mess_id = db.session.query(Month.mess_id).filter(Month.id == month_id).scalar()
+
+        # balances carry forward from the mess's last closed month
+        previous = db.session.query(MonthClose.month_id) \
+            .join(Month, Month.id == MonthClose.month_id) \
+            .filter(Month.mess_id == mess_id, MonthClose.month_id < month_id, MonthClose.status == 'done') \
+            .order_by(MonthClose.month_id.desc()).limit(1).scalar()
+        brought = dict(db.session.query(MonthCloseBalance.user_id, MonthCloseBalance.carry_forward)
+                       .filter_by(month_id=previous)) if previous else {}
+
+        totals = raw_user_totals(month_id)
+        users = get_roster(mess_id).by_id
+        user_ids = sorted(users.keys() | totals.keys() | brought.keys())
+        meals = [totals.get(user_id, (0, ZERO))[0] for user_id in user_ids]
+        deposits = [totals.get(user_id, (0, ZERO))[1] for user_id in user_ids]
+        costs, balances = compute_balances(total_bazar, meals, deposits)
+        rows = []
+        for user_id, total_meal, deposit, meal_cost, balance in zip(user_ids, meals, deposits, costs, balances):
+            user = users.get(user_id)
+            brought_forward = brought.get(user_id, ZERO)
+            rows.append({
+                'month_id': month_id, 'user_id': user_id,
+                'name': user.name if user else None,
+                'username': user.username if user else None,
+                'role': user.role if user else None,
+                'total_meal': total_meal, 'deposit': deposit, 'meal_cost': meal_cost,
+                'balance': balance, 'brought_forward': brought_forward,
+                'carry_forward': brought_forward + balance,
+            })
+
+        MonthCloseBalance.query.filter_by(month_id=month_id).delete()
+        if rows:
+            db.session.execute(MonthCloseBalance.__table__.insert(), rows)
+        close.total_bazar, close.total_meals = total_bazar, total_meals
+        close.meal_rate = meal_rate(total_bazar, total_meals)
+        close.ledger_version = summary.version if summary else 0
+        close.closed_at = _utcnow()
+        close.status, close.error = 'done', None
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        close = db.session.get(MonthClose, month_id)
+        if close is not None:
+            close.status, close.error = 'failed', str(e)[:1000]
+            db.session.commit()
+        raise
+    return close
@@ -0,0 +1,285 @@
+import click
+from flask.cli import with_appcontext
+
+from auth import hash_password
+from models import db, DEFAULT_MESS_ID, Mess, Month, Meal, MonthClose, DailyRollup
+from ledger import rebuild_month_summary, rebuild_daily_rollups, invalidate_roster, get_active_month
+from closing import close_month
+from events import backfill_checkpoints
+from tenancy import ensure_default_mess, create_mess, delete_mess, export_mess, import_mess
+from transfer import import_csv, IMPORT_COLUMNS
+
+
+@click.command('rebuild-ledger')
+@with_appcontext
+def rebuild_ledger_command():
+    """Recompute ledger summaries from raw rows and report any drift."""
+    drift = []
+    for month in Month.query.order_by(Month.id):
+        drift.extend(rebuild_month_summary(month.id))
+    # users edited outside the app (e.g. in the SQL editor) reach the workers' rosters too
+    for (mess_id,) in db.session.query(Mess.id):
+        invalidate_roster(mess_id)
+    db.session.commit()
+    for line in drift:
+        print(line)
+    print(f"Ledger rebuilt, {len(drift)} difference(s) found.")
+
+
+# Fold duplicate (user, date, month) meal rows into the oldest one so the
+# unique index can be created. Totals are unchanged. Returns rows removed.
+def merge_duplicate_meals():
+    dupes = db.session.query(Meal.user_id, Meal.date, Meal.month_id) \
+        .group_by(Meal.user_id, Meal.date, Meal.month_id) \
+        .having(db.func.count(Meal.id) > 1).all()
+    removed = 0
+    for user_id, day, month_id in dupes:
+        rows = Meal.query.filter_by(user_id=user_id, date=day, month_id=month_id) \
+            .order_by(Meal.id).all()
+        keep = rows[0]
+        for row in rows[1:]:
+            keep.morning += row.morning
+            keep.lunch += row.lunch
+            keep.dinner += row.dinner
+            db.session.delete(row)
+            removed += 1
+    return removed
+
+
+# Build daily rollups for months that have entries but no rollup rows yet
+# (databases from before rollups existed). Returns the months filled.
+def backfill_daily_rollups():
+    rolled = {month_id for (month_id,) in db.session.query(DailyRollup.month_id).distinct()}
+    filled = []
+    for month in Month.query.order_by(Month.id):
+        if month.id not in rolled:
+            rebuild_daily_rollups(month.id)
+            if DailyRollup.query.filter_by(month_id=month.id).first():
+                filled.append(month.id)
+    return filled
+
+
+# ALTER TABLE ... ADD COLUMN for model columns missing from existing tables.
+# New columns must be nullable or carry a server_default. Returns names added.
+def add_missing_columns():
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = db.schema.CreateColumn(column).compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+            added.append(f'{table.name}.{column.name}')
+    return added
+
+
+# Indexes replaced by the current ones: table -> index names
+OLD_INDEXES = {
+    'user': ('ix_user_mess_name',),          # by ix_user_mess_id
+    'daily_rollup': ('ix_daily_rollup_day',),  # by ix_daily_rollup_mess_day
+}
+
+
+def drop_old_indexes():
+    inspector = db.inspect(db.engine)
+    dropped = []
+    for table, names in OLD_INDEXES.items():
+        if not inspector.has_table(table):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table)}
+        for name in names:
+            if name in existing:
+                db.session.execute(db.text(f'DROP INDEX {name}'))
+                dropped.append(name)
+    return dropped
+
+
+# Daily rollups from before they carried their month's mess get it copied over
+def upgrade_daily_rollups(added):
+    if 'daily_rollup.mess_id' in added:
+        db.session.execute(DailyRollup.__table__.update().values(
+            mess_id=db.session.query(Month.mess_id).filter(Month.id == DailyRollup.month_id).scalar_subquery()))
+
+
+# Money columns used to be FLOAT. PostgreSQL tables are converted to
+# NUMERIC(12, 2) in place (rounded to the cent); SQLite cannot change a
+# column's type, but its values are rounded to the cent whenever they are
+# read. Returns names converted.
+def convert_money_columns():
+    if db.engine.dialect.name != 'postgresql':
+        return []
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    converted = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name']: c['type'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if not isinstance(column.type, db.Numeric) or isinstance(column.type, db.Float):
+                continue
+            if not isinstance(existing.get(column.name), db.Float):
+                continue
+            name = preparer.quote(column.name)
+            db.session.execute(db.text(
+                f'ALTER TABLE {preparer.format_table(table)} ALTER COLUMN {name} '
+                f'TYPE NUMERIC(12, 2) USING round({name}::numeric, 2)'))
+            converted.append(f'{table.name}.{column.name}')
+    return converted
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Bring an existing database up to the current schema (tables, columns and indexes)."""
+    db.create_all()
+    # existing users and months join the default mess as the column is added
+    ensure_default_mess()
+    added = add_missing_columns()
+    for name in added:
+        print(f"Added column {name}.")
+    upgrade_daily_rollups(added)
+    for name in drop_old_indexes():
+        print(f"Dropped index {name}.")
+    converted = convert_money_columns()
+    for name in converted:
+        print(f"Converted {name} to NUMERIC(12, 2).")
+    removed = merge_duplicate_meals()
+    db.session.commit()
+    if removed:
+        print(f"Merged {removed} duplicate meal row(s).")
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    filled = backfill_daily_rollups()
+    db.session.commit()
+    if filled:
+        print(f"Built daily rollups for {len(filled)} month(s).")
+    checkpointed = backfill_checkpoints()
+    db.session.commit()
+    if checkpointed:
+        print(f"Recorded starting ledger checkpoints for {len(checkpointed)} month(s).")
+    if converted:
+        print("Run rebuild-ledger to recompute the summaries from the rounded amounts.")
+    print("Database schema is up to date.")
+
+
+@click.command('close-months')
+@click.option('--force', is_flag=True, help='Also redo closes left "running" by a worker that died.')
+@with_appcontext
+def close_months_command(force):
+    """Freeze every inactive month that has no finished month-close report."""
+    done = {month_id for (month_id,) in db.session.query(MonthClose.month_id).filter_by(status='done')}
+    for month in Month.query.filter_by(is_active=False).order_by(Month.id):
+        if month.id in done:
+            continue
+        try:
+            close = close_month(month.id, force=force)
+        except Exception as e:
+            print(f"{month.name}: failed ({e})")
+            continue
+        print(f"{month.name}: {close.status}")
+
+
+# ---------------- IMPORT ----------------
+@click.command('import-csv')
+@click.argument('kind', type=click.Choice(sorted(IMPORT_COLUMNS)))
+@click.argument('csv_file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--month', 'month_name', help='Month (name or id) for rows without a "month" column. '
+                                            'Defaults to the active month.')
+@click.option('--mess', 'mess_id', default=DEFAULT_MESS_ID, show_default=True,
+              help='Id of the mess to import into (see list-messes).')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per transaction.')
+@with_appcontext
+def import_csv_command(kind, csv_file, month_name, mess_id, batch_size):
+    """Stream meals, deposits or bazar entries from CSV_FILE into a mess."""
+    if month_name:
+        months = Month.query.filter_by(mess_id=mess_id)
+        month = months.filter_by(name=month_name).first()
+        if not month and month_name.isdigit():
+            month = months.filter_by(id=int(month_name)).first()
+        if not month:
+            raise click.BadParameter(f"no month named {month_name!r}", param_hint='--month')
+        month_id = month.id
+    else:
+        active = get_active_month(mess_id)
+        month_id = active.id if active else None
+
+    try:
+        result = import_csv(kind, csv_file, mess_id, month_id, batch_size=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for line, reason in result['rejected']:
+        click.echo(f"line {line}: {reason}", err=True)
+    if result['rejected_count'] > len(result['rejected']):
+        click.echo(f"... {result['rejected_count'] - len(result['rejected'])} more rejected", err=True)
+    print(f"Imported {result['imported']} {kind} row(s) in {result['seconds']:.1f}s "
+          f"({result['rows_per_second']:.0f} rows/s), {result['rejected_count']} rejected.")
+
+
+# ---------------- MESSES ----------------
+@click.command('create-mess')
+@click.argument('name')
+@click.option('--manager', 'username', required=True, help='Username for the mess\'s first manager.')
+@click.password_option(help='Their first password; they are asked to change it on login.')
+@with_appcontext
+def create_mess_command(name, username, password):
+    """Add a mess (hostel) with its first manager."""
+    try:
+        mess = create_mess(name, username, hash_password(password))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Mess {mess.id} \"{mess.name}\" created; {username} can log in.")
+
+
+@click.command('list-messes')
+@with_appcontext
+def list_messes_command():
+    """Show every mess with its id."""
+    for mess in Mess.query.order_by(Mess.id):
+        print(f"{mess.id}\t{mess.name}")
+
+
+@click.command('export-mess')
+@click.argument('mess_id', type=int)
+@click.argument('out', type=click.File('w', encoding='utf-8'), default='-')
+@with_appcontext
+def export_mess_command(mess_id, out):
+    """Write a mess's users, months and entries as JSON lines (to stdout by default)."""
+    try:
+        out.writelines(export_mess(mess_id))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@click.command('import-mess')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--name', help='Name for the new mess (default: the exported one).')
+@with_appcontext
+def import_mess_command(source, name):
+    """Load an export-mess file as a new mess, with fresh ids."""
+    try:
+        mess = import_mess(source, name)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Imported as mess {mess.id} \"{mess.name}\".")
+
+
+@click.command('delete-mess')
+@click.argument('mess_id', type=int)
+@click.confirmation_option(prompt='This deletes the mess with all its users, months and entries. Continue?')
+@with_appcontext
+def delete_mess_command(mess_id):
+    """Delete a mess and everything in it."""
+    mess = db.session.get(Mess, mess_id)
+    if mess is None:
+        raise click.ClickException(f"no mess with id {mess_id}")
+    name = mess.name
+    delete_mess(mess_id)
+    print(f"Deleted mess {mess_id} \"{name}\".")
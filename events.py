@@ -0,0 +1,164 @@
+"""Append-only ledger events and point-in-time balances.
+
+Every ledger change (a meal, deposit or bazar entry added or deleted, a
+bulk import, a rebuild-ledger correction) is recorded as one event with
+the deltas it applied; user and month changes are recorded too. Events are
+queued on the session and written with one executemany INSERT when it
+commits, in the same transaction as the change itself.
+
+A month's balances at any moment are its latest checkpoint before then
+plus the events after it. A checkpoint copies the running summary tables
+once every LEDGER_CHECKPOINT_EVERY events of a month, so a point-in-time
+lookup never sums more than that many events.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from flask import current_app, has_request_context
+from flask_login import current_user
+from sqlalchemy import event
+
+from models import (db, Month, MonthSummary, UserMonthBalance, LedgerEvent, LedgerCheckpoint,
+                    LedgerCheckpointBalance)
+
+PENDING = 'ledger_events'
+# event kinds that change balances; the rest are for the audit trail only
+LEDGER_KINDS = ('meal', 'deposit', 'bazar', 'adjust')
+ZERO = Decimal('0.00')
+LOG_START = datetime(1970, 1, 1)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# ---------------- RECORDING ----------------
+def _actor():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+
+# Queue an event; it is written when the session commits, or dropped with
+# a rollback. mess_id may be left out for events with a month_id.
+def record_event(kind, month_id=None, mess_id=None, user_id=None, day=None, meals=0, deposit=0,
+                 bazar=0, detail=None):
+    db.session.info.setdefault(PENDING, []).append({
+        'at': utcnow(), 'mess_id': mess_id, 'month_id': month_id, 'actor_id': _actor(), 'kind': kind,
+        'user_id': user_id, 'day': day, 'meals': meals or None, 'deposit': deposit or None,
+        'bazar': bazar or None, 'detail': detail[:150] if detail else None,
+    })
+
+
+@event.listens_for(db.session, 'before_commit')
+def _write_events(session):
+    rows = session.info.pop(PENDING, None)
+    if not rows:
+        return
+    session.flush()
+    month_ids = {row['month_id'] for row in rows if row['mess_id'] is None and row['month_id'] is not None}
+    if month_ids:
+        messes = dict(session.query(Month.id, Month.mess_id).filter(Month.id.in_(month_ids)))
+        for row in rows:
+            if row['mess_id'] is None:
+                row['mess_id'] = messes.get(row['month_id'])
+    session.execute(LedgerEvent.__table__.insert(), rows)
+
+    every = current_app.config['LEDGER_CHECKPOINT_EVERY']
+    if every:
+        for month_id in {row['month_id'] for row in rows if row['kind'] in LEDGER_KINDS}:
+            if events_since_checkpoint(month_id) >= every:
+                checkpoint_month(month_id)
+
+
+# Queued events belong to the transaction they were recorded in
+@event.listens_for(db.session, 'after_transaction_end')
+def _discard_events(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(PENDING, None)
+
+
+# ---------------- CHECKPOINTS ----------------
+def events_since_checkpoint(month_id):
+    last = db.session.query(db.func.max(LedgerCheckpoint.event_id)) \
+        .filter(LedgerCheckpoint.month_id == month_id).scalar_subquery()
+    return db.session.query(db.func.count(LedgerEvent.id)).filter(
+        LedgerEvent.month_id == month_id, LedgerEvent.id > db.func.coalesce(last, 0)).scalar()
+
+
+# Copy a month's running totals as of its latest event. Call with the
+# summaries up to date, i.e. in the transaction that wrote the events.
+def checkpoint_month(month_id, at=None):
+    event_id = db.session.query(db.func.max(LedgerEvent.id)) \
+        .filter(LedgerEvent.month_id == month_id).scalar() or 0
+    if db.session.query(LedgerCheckpoint.event_id).filter_by(month_id=month_id, event_id=event_id).first():
+        return
+    totals = db.session.query(MonthSummary.total_bazar, MonthSummary.total_meals) \
+        .filter(MonthSummary.month_id == month_id).first() or (ZERO, 0)
+    db.session.execute(LedgerCheckpoint.__table__.insert().values(
+        month_id=month_id, event_id=event_id, at=at or utcnow(),
+        total_bazar=totals[0], total_meals=totals[1]))
+    balances = [{'month_id': month_id, 'event_id': event_id, 'user_id': user_id,
+                 'total_meal': total_meal, 'deposit': deposit}
+                for user_id, total_meal, deposit in db.session.query(
+                    UserMonthBalance.user_id, UserMonthBalance.total_meal, UserMonthBalance.deposit)
+                .filter(UserMonthBalance.month_id == month_id)
+                if total_meal or deposit]
+    if balances:
+        db.session.execute(LedgerCheckpointBalance.__table__.insert(), balances)
+
+
+# Months from before the event log get a checkpoint of their current
+# totals dated LOG_START, so replays of any moment start from what they
+# held when the log began. Returns the months.
+def backfill_checkpoints():
+    done = {month_id for (month_id,) in db.session.query(LedgerCheckpoint.month_id).distinct()}
+    filled = []
+    for (month_id,) in db.session.query(Month.id).order_by(Month.id):
+        if month_id not in done:
+            checkpoint_month(month_id, at=LOG_START)
+            filled.append(month_id)
+    return filled
+
+
+# ---------------- REPLAY ----------------
+# A month's ledger as of `when` (naive UTC): totals, {user_id: (total_meal,
+# deposit)} for users with any, and the id of the last event applied.
+# Before the log started, months read as their backfilled checkpoint.
+LedgerState = namedtuple('LedgerState', ['event_id', 'total_bazar', 'total_meals', 'users'])
+
+
+def ledger_at(month_id, when):
+    checkpoint = LedgerCheckpoint.query.filter(LedgerCheckpoint.month_id == month_id,
+                                               LedgerCheckpoint.at <= when) \
+        .order_by(LedgerCheckpoint.event_id.desc()).first()
+    if checkpoint is None:
+        event_id, total_bazar, total_meals, users = 0, ZERO, 0, {}
+    else:
+        event_id, total_bazar, total_meals = checkpoint.event_id, checkpoint.total_bazar, checkpoint.total_meals
+        users = _checkpoint_users(checkpoint)
+
+    rows = db.session.query(
+        LedgerEvent.user_id, db.func.max(LedgerEvent.id),
+        db.func.coalesce(db.func.sum(LedgerEvent.meals), 0),
+        db.func.coalesce(db.func.sum(LedgerEvent.deposit), 0),
+        db.func.coalesce(db.func.sum(LedgerEvent.bazar), 0),
+    ).filter(LedgerEvent.month_id == month_id, LedgerEvent.id > event_id, LedgerEvent.at <= when,
+             LedgerEvent.kind.in_(LEDGER_KINDS)).group_by(LedgerEvent.user_id)
+    for user_id, last_id, meals, deposit, bazar in rows:
+        event_id = max(event_id, last_id)
+        total_meals += meals
+        total_bazar += Decimal(str(bazar))
+        if user_id is not None:
+            total_meal, total_deposit = users.get(user_id, (0, ZERO))
+            users[user_id] = (total_meal + meals, total_deposit + Decimal(str(deposit)))
+    return LedgerState(event_id, Decimal(total_bazar).quantize(ZERO), total_meals,
+                       {user_id: (meals, Decimal(deposit).quantize(ZERO))
+                        for user_id, (meals, deposit) in users.items() if meals or deposit})
+
+
+def _checkpoint_users(checkpoint):
+    return {user_id: (total_meal, deposit) for user_id, total_meal, deposit in db.session.query(
+        LedgerCheckpointBalance.user_id, LedgerCheckpointBalance.total_meal, LedgerCheckpointBalance.deposit)
+        .filter_by(month_id=checkpoint.month_id, event_id=checkpoint.event_id)}
@@ -0,0 +1,98 @@
+import random
+import time
+from datetime import date, timedelta
+
+import click
+
+from auth import hash_password
+from ledger import invalidate_roster, rebuild_month_summary
+from models import db, DEFAULT_MESS_ID, Mess, User, Month, Meal, Deposit, Bazar
+
+
+# Wipe the database and fill it with a synthetic hostel: user0 is the
+# manager, everyone logs in with password "bench", the last month is
+# active. Rows go in with executemany batches; ledger summaries are built
+# at the end. Returns row counts per table.
+def generate(users=500, months=36, days=30, attendance=0.85, seed=42, batch_size=5000):
+    rng = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    db.session.add(Mess(id=DEFAULT_MESS_ID, name='Bench Mess'))
+    password = hash_password('bench')
+    db.session.execute(User.__table__.insert(), [
+        {'mess_id': DEFAULT_MESS_ID, 'name': f'User {i}', 'username': f'user{i}', 'password': password,
+         'role': 'manager' if i == 0 else 'boarder', 'first_login': False}
+        for i in range(users)
+    ])
+    user_ids = [uid for (uid,) in db.session.query(User.id).order_by(User.id)]
+    invalidate_roster(DEFAULT_MESS_ID)
+
+    start = date(2030, 1, 1) - timedelta(days=days * months)
+    db.session.execute(Month.__table__.insert(), [
+        {'mess_id': DEFAULT_MESS_ID, 'name': f'Month {m + 1} ({start + timedelta(days=m * days):%b %Y})',
+         'is_active': m == months - 1}
+        for m in range(months)
+    ])
+    month_ids = [mid for (mid,) in db.session.query(Month.id).order_by(Month.id)]
+
+    counts = {'users': len(user_ids), 'months': len(month_ids), 'meals': 0, 'deposits': 0, 'bazar': 0}
+    meals = []
+    for m, month_id in enumerate(month_ids):
+        first_day = start + timedelta(days=m * days)
+        for d in range(days):
+            day = first_day + timedelta(days=d)
+            for uid in user_ids:
+                if rng.random() < attendance:
+                    meals.append({'date': day, 'user_id': uid, 'month_id': month_id,
+                                  'morning': rng.randint(0, 1), 'lunch': rng.randint(0, 2),
+                                  'dinner': rng.randint(0, 2)})
+            if len(meals) >= batch_size:
+                db.session.execute(Meal.__table__.insert(), meals)
+                counts['meals'] += len(meals)
+                meals = []
+
+        deposits = [{'date': first_day + timedelta(days=rng.randrange(days)), 'month_id': month_id,
+                     'boarder_id': uid, 'amount': float(rng.randint(5, 40) * 100)}
+                    for uid in user_ids for _ in range(rng.randint(1, 3))]
+        bazar = [{'date': first_day + timedelta(days=d), 'month_id': month_id,
+                  'description': rng.choice(('Rice', 'Vegetables', 'Fish', 'Chicken', 'Oil', 'Gas')),
+                  'cost': round(rng.uniform(0.5, 5) * len(user_ids) * 10, 2)}
+                 for d in range(0, days, 2)]
+        db.session.execute(Deposit.__table__.insert(), deposits)
+        db.session.execute(Bazar.__table__.insert(), bazar)
+        counts['deposits'] += len(deposits)
+        counts['bazar'] += len(bazar)
+    if meals:
+        db.session.execute(Meal.__table__.insert(), meals)
+        counts['meals'] += len(meals)
+    db.session.commit()
+
+    for month_id in month_ids:
+        rebuild_month_summary(month_id)
+    db.session.commit()
+    return counts
+
+
+@click.command()
+@click.option('--users', default=500, show_default=True)
+@click.option('--months', default=36, show_default=True)
+@click.option('--days', default=30, show_default=True, help='Days per month.')
+@click.option('--attendance', default=0.85, show_default=True, help='Chance a user eats on a given day.')
+@click.option('--seed', default=42, show_default=True)
+@click.confirmation_option(prompt='This deletes ALL data in DATABASE_URL. Continue?')
+def main(users, months, days, attendance, seed):
+    """Replace the database contents with a synthetic hostel dataset."""
+    from app import create_app
+
+    started = time.perf_counter()
+    with create_app().app_context():
+        counts = generate(users, months, days, attendance, seed)
+        url = db.engine.url.render_as_string(hide_password=True)
+    click.echo(', '.join(f'{n} {name}' for name, n in counts.items()) +
+               f' written to {url} in {time.perf_counter() - started:.1f}s')
+    click.echo('Log in as user0 (manager) or user1.. (boarders) with password "bench".')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+# Picked up automatically by `gunicorn wsgi:app` when started from this folder.
+# Add --preload to import the app once in the master and fork the workers
+# from it instead of having each worker import it again.
+
+
+# Runs once in the master before any worker starts, so the schema check
+# happens once per deploy instead of once per worker boot. The engine is
+# disposed so no connection is shared with the forked workers.
+def on_starting(server):
+    from app import create_app
+    from models import db
+    from tenancy import ensure_default_mess
+    with create_app().app_context():
+        db.create_all()
+        ensure_default_mess()
+        db.engine.dispose()
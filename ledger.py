@@ -0,0 +1,452 @@
+from flask import current_app
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from itertools import accumulate
+import operator
+import time
+
+from models import (db, User, Month, Meal, Deposit, Bazar, MonthSummary, UserMonthBalance, CacheVersion,
+                    DailyRollup)
+from events import record_event
+
+
+# ---------------- MONEY ----------------
+# Amounts are stored as NUMERIC(12, 2) and read back as Decimal. Balance
+# math runs on whole cents (ints), so nothing drifts and the meal costs of
+# a month always add up to its bazar total exactly.
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+# largest value NUMERIC(12, 2) holds
+MAX_AMOUNT = Decimal('9999999999.99')
+
+
+def to_cents(amount):
+    return int(Decimal(amount).scaleb(2).to_integral_value())
+
+
+def from_cents(cents):
+    return CENT * cents
+
+
+# Parse a form/CSV amount; raises ValueError unless it is a finite number
+# with at most two decimal places that fits the amount columns, and (unless
+# allow_negative) is not below zero. Every entry path goes through here.
+def parse_amount(text, allow_negative=False):
+    try:
+        amount = Decimal(str(text).strip())
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite() or amount != amount.quantize(CENT):
+        raise ValueError(f"bad amount {text!r}: use a number with at most two decimal places")
+    if abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"amount {text!r} is too large")
+    if amount < 0 and not allow_negative:
+        raise ValueError(f"negative amount {text!r}")
+    return amount.quantize(CENT)
+
+
+def meal_rate(total_bazar, total_meals):
+    return (Decimal(total_bazar) / total_meals).quantize(CENT) if total_meals > 0 else ZERO
+
+
+# Split a month's bazar total over users' meal counts (ordered by user id).
+# User i pays floor(T * C_i / M) - floor(T * C_i-1 / M) cents, where C_i is
+# the running meal count through user i: each share is within a cent of
+# the exact one and the shares telescope to T. Done as one pass over whole
+# lists rather than a rounding step per user.
+def meal_cost_cents(total_bazar, meals):
+    cumulative = list(accumulate(meals))
+    if not cumulative or cumulative[-1] <= 0:
+        return [0] * len(cumulative)
+    total, total_meals = to_cents(total_bazar), cumulative[-1]
+    edges = [total * c // total_meals for c in cumulative]
+    return list(map(operator.sub, edges, [0] + edges[:-1]))
+
+
+# Meal cost and balance for parallel lists of meal counts and deposits
+# (ordered by user id), as lists of Decimal. Deposits already have at most
+# two places, so the subtraction is exact.
+def compute_balances(total_bazar, meals, deposits):
+    costs = list(map(CENT.__mul__, meal_cost_cents(total_bazar, meals)))
+    return costs, list(map(operator.sub, deposits, costs))
+
+
+# One user's share under meal_cost_cents without loading the whole month:
+# only the meal count of users with lower ids is needed.
+def user_meal_cost(month_id, user_id, total_bazar, total_meals, total_meal):
+    if total_meals <= 0:
+        return ZERO
+    before = db.session.query(db.func.coalesce(db.func.sum(UserMonthBalance.total_meal), 0)) \
+        .filter(UserMonthBalance.month_id == month_id, UserMonthBalance.user_id < user_id).scalar()
+    total = to_cents(total_bazar)
+    return from_cents(total * (before + total_meal) // total_meals - total * before // total_meals)
+
+
+# ---------------- ACTIVE MONTH ----------------
+# Nearly every route needs its mess's active month, so each worker keeps
+# them for ACTIVE_MONTH_TTL seconds. Month changes clear the local copy
+# straight away; other gunicorn workers pick them up once theirs expires.
+ActiveMonth = namedtuple('ActiveMonth', ['id', 'name'])
+_active_month_cache = {}  # mess_id -> (ActiveMonth or None, expires)
+
+
+def get_active_month(mess_id):
+    now = time.monotonic()
+    cached = _active_month_cache.get(mess_id)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+    month = Month.query.filter_by(mess_id=mess_id, is_active=True).order_by(Month.id.desc()).first()
+    value = ActiveMonth(month.id, month.name) if month else None
+    _active_month_cache[mess_id] = (value, now + current_app.config['ACTIVE_MONTH_TTL'])
+    return value
+
+
+def invalidate_active_month(mess_id):
+    _active_month_cache.pop(mess_id, None)
+
+
+# ---------------- ROSTER ----------------
+# The user dropdowns, user list and balance tables only need a few columns
+# of a mess's users, so each worker keeps them in memory. The copy is
+# checked against the mess's "roster:<id>" CacheVersion row on each use;
+# add/edit/delete user bump that row, so every worker reloads on its next
+# request. A large mess's roster never has to be reloaded for a small one.
+RosterUser = namedtuple('RosterUser', ['id', 'name', 'username', 'role'])
+# users ordered by name for forms, by_id ordered by id for balance tables
+Roster = namedtuple('Roster', ['version', 'users', 'by_id'])
+_roster_cache = {}  # mess_id -> Roster
+_roster_version_cache = {}  # mess_id -> (version, expires)
+
+
+def roster_key(mess_id):
+    return f'roster:{mess_id}'
+
+
+def roster_version(mess_id):
+    return db.session.query(CacheVersion.version).filter_by(name=roster_key(mess_id)).scalar() or 0
+
+
+# roster_version() reused for USER_CACHE_TTL seconds, for the per-request
+# user loader. Like the active month, other workers see a change once
+# their copy expires.
+def cached_roster_version(mess_id):
+    now = time.monotonic()
+    cached = _roster_version_cache.get(mess_id)
+    if cached is None or now >= cached[1]:
+        cached = _roster_version_cache[mess_id] = (roster_version(mess_id),
+                                                   now + current_app.config['USER_CACHE_TTL'])
+    return cached[0]
+
+
+# A mess's users in id order, read through ix_user_mess_id
+def roster_query(mess_id):
+    return db.session.query(User.id, User.name, User.username, User.role) \
+        .filter(User.mess_id == mess_id).order_by(User.id)
+
+
+def get_roster(mess_id):
+    version = roster_version(mess_id)
+    roster = _roster_cache.get(mess_id)
+    if roster is not None and roster.version == version:
+        return roster
+    users = [RosterUser(*row) for row in roster_query(mess_id)]
+    roster = Roster(version, sorted(users, key=lambda u: (u.name or '', u.id)),
+                    {u.id: u for u in users})
+    _roster_cache[mess_id] = roster
+    return roster
+
+
+# Call before committing a change to a mess's users; the bump commits with it
+def invalidate_roster(mess_id):
+    _roster_cache.pop(mess_id, None)
+    _roster_version_cache.pop(mess_id, None)
+    key = roster_key(mess_id)
+    bumped = CacheVersion.__table__.update().where(CacheVersion.name == key) \
+        .values(version=CacheVersion.version + 1)
+    if db.session.execute(bumped).rowcount == 0:
+        db.session.add(CacheVersion(name=key, version=1))
+
+
+# ---------------- AGGREGATES ----------------
+# Month-wide bazar cost and meal count, summed in the database
+def month_totals(month_id):
+    total_bazar = db.session.query(
+        db.func.coalesce(db.func.sum(Bazar.cost), 0)
+    ).filter(Bazar.month_id == month_id).scalar()
+    total_meals = db.session.query(
+        db.func.coalesce(db.func.sum(Meal.morning + Meal.lunch + Meal.dinner), 0)
+    ).filter(Meal.month_id == month_id).scalar()
+    return total_bazar, total_meals
+
+
+# Raw per-user sums for a month, keyed by user id: {user_id: (meals, deposit)}
+def raw_user_totals(month_id):
+    totals = {}
+    meal_rows = db.session.query(
+        Meal.user_id, db.func.sum(Meal.morning + Meal.lunch + Meal.dinner)
+    ).filter(Meal.month_id == month_id).group_by(Meal.user_id)
+    for user_id, meals in meal_rows:
+        totals[user_id] = (meals or 0, ZERO)
+    deposit_rows = db.session.query(
+        Deposit.boarder_id, db.func.sum(Deposit.amount)
+    ).filter(Deposit.month_id == month_id).group_by(Deposit.boarder_id)
+    for user_id, deposit in deposit_rows:
+        totals[user_id] = (totals.get(user_id, (0, ZERO))[0], deposit or ZERO)
+    return totals
+
+
+# Recompute a month's summary rows from the raw tables. Returns a list of
+# human-readable differences between what was stored and the fresh totals.
+# Each difference is also logged as an "adjust" event, so replaying the
+# event log still ends at the stored totals.
+def rebuild_month_summary(month_id):
+    drift = []
+    total_bazar, total_meals = month_totals(month_id)
+
+    summary = db.session.get(MonthSummary, month_id)
+    stored_bazar, stored_meals = (summary.total_bazar, summary.total_meals) if summary else (ZERO, 0)
+    if summary is None:
+        summary = MonthSummary(month_id=month_id)
+        db.session.add(summary)
+    else:
+        if summary.total_meals != total_meals:
+            drift.append(f'month {month_id}: total_meals {summary.total_meals} -> {total_meals}')
+        if summary.total_bazar != total_bazar:
+            drift.append(f'month {month_id}: total_bazar {summary.total_bazar} -> {total_bazar}')
+    summary.total_bazar = total_bazar
+    summary.total_meals = total_meals
+    summary.version = (summary.version or 0) + 1
+
+    fresh = raw_user_totals(month_id)
+    stored = {b.user_id: b for b in UserMonthBalance.query.filter_by(month_id=month_id)}
+    user_meal_deltas = 0
+    for user_id in set(fresh) | set(stored):
+        meals, deposit = fresh.get(user_id, (0, 0))
+        balance = stored.get(user_id)
+        meal_delta = meals - (balance.total_meal if balance else 0)
+        deposit_delta = deposit - (balance.deposit if balance else ZERO)
+        if meal_delta or deposit_delta:
+            record_event('adjust', month_id, user_id=user_id, meals=meal_delta, deposit=deposit_delta)
+            user_meal_deltas += meal_delta
+        if balance is None:
+            if meals or deposit:
+                drift.append(f'month {month_id} user {user_id}: missing balance row')
+            balance = UserMonthBalance(month_id=month_id, user_id=user_id)
+            db.session.add(balance)
+        else:
+            if balance.total_meal != meals:
+                drift.append(f'month {month_id} user {user_id}: total_meal {balance.total_meal} -> {meals}')
+            if balance.deposit != deposit:
+                drift.append(f'month {month_id} user {user_id}: deposit {balance.deposit} -> {deposit}')
+        balance.total_meal = meals
+        balance.deposit = deposit
+    # meals outside any user's totals and bazar go on one month-level event
+    if total_meals - stored_meals != user_meal_deltas or total_bazar != stored_bazar:
+        record_event('adjust', month_id, meals=total_meals - stored_meals - user_meal_deltas,
+                     bazar=total_bazar - stored_bazar)
+
+    drift.extend(rebuild_daily_rollups(month_id))
+    return drift
+
+
+# ---------------- DAILY ROLLUPS ----------------
+# Raw per-day sums for a month: {day: (meals, bazar)}
+def raw_daily_totals(month_id):
+    totals = {}
+    meal_rows = db.session.query(
+        Meal.date, db.func.sum(Meal.morning + Meal.lunch + Meal.dinner)
+    ).filter(Meal.month_id == month_id).group_by(Meal.date)
+    for day, meals in meal_rows:
+        totals[day] = (meals or 0, ZERO)
+    bazar_rows = db.session.query(
+        Bazar.date, db.func.sum(Bazar.cost)
+    ).filter(Bazar.month_id == month_id).group_by(Bazar.date)
+    for day, bazar in bazar_rows:
+        if day is not None:
+            totals[day] = (totals.get(day, (0, ZERO))[0], bazar or ZERO)
+    return totals
+
+
+def _month_mess(month_id):
+    return db.session.query(Month.mess_id).filter(Month.id == month_id).scalar()
+
+
+# Replace a month's daily rollups with fresh sums. Returns differences, but
+# only for a month that had rollups already (first builds are not drift).
+def rebuild_daily_rollups(month_id):
+    fresh = {day: totals for day, totals in raw_daily_totals(month_id).items() if any(totals)}
+    stored = {r.day: (r.meals, r.bazar) for r in DailyRollup.query.filter_by(month_id=month_id)}
+    drift = []
+    if stored:
+        for day in sorted(set(fresh) | set(stored)):
+            if fresh.get(day, (0, ZERO)) != stored.get(day, (0, ZERO)):
+                drift.append(f'month {month_id} day {day}: rollup {stored.get(day, (0, ZERO))} '
+                             f'-> {fresh.get(day, (0, ZERO))}')
+    DailyRollup.query.filter_by(month_id=month_id).delete(synchronize_session=False)
+    if fresh:
+        mess_id = _month_mess(month_id)
+        db.session.execute(DailyRollup.__table__.insert(), [
+            {'month_id': month_id, 'mess_id': mess_id, 'day': day, 'meals': meals, 'bazar': bazar}
+            for day, (meals, bazar) in fresh.items()
+        ])
+    return drift
+
+
+# Add per-day deltas {day: (meals, bazar)} to a month's rollups: one
+# executemany UPDATE, inserting only the days that have no row yet.
+def update_daily_rollups(month_id, days):
+    days = {day: delta for day, delta in days.items() if day is not None and any(delta)}
+    if not days:
+        return
+    existing = {day for (day,) in db.session.query(DailyRollup.day).filter(
+        DailyRollup.month_id == month_id, DailyRollup.day.in_(days))}
+    if existing:
+        rollups = DailyRollup.__table__
+        db.session.execute(
+            rollups.update()
+            .where(rollups.c.month_id == db.bindparam('m_id'), rollups.c.day == db.bindparam('d'))
+            .values(meals=rollups.c.meals + db.bindparam('meal_delta'),
+                    bazar=rollups.c.bazar + db.bindparam('bazar_delta')),
+            [{'m_id': month_id, 'd': day, 'meal_delta': days[day][0], 'bazar_delta': days[day][1]}
+             for day in existing]
+        )
+    if len(existing) == len(days):
+        return
+    mess_id = _month_mess(month_id)
+    db.session.bulk_insert_mappings(DailyRollup, [
+        {'month_id': month_id, 'mess_id': mess_id, 'day': day, 'meals': meals, 'bazar': bazar}
+        for day, (meals, bazar) in days.items() if day not in existing
+    ])
+
+
+# Apply a change to the running totals. Call after adding/deleting the raw
+# row and before commit; increments are done in SQL so concurrent workers
+# don't lose each other's updates. A month with no summary yet (e.g. data
+# from before this table existed) is rebuilt from the raw rows instead.
+# `kind` is the entry's ledger event kind ('meal', 'deposit' or 'bazar');
+# `day` is its date, for the daily rollups; it and `note` (e.g. the bazar
+# description) are kept on the event.
+def update_ledger(kind, month_id, user_id=None, meals=0, deposit=0, bazar=0, day=None, note=None):
+    if month_id is None:
+        return
+    db.session.flush()
+    updated = MonthSummary.query.filter_by(month_id=month_id).update({
+        MonthSummary.total_meals: MonthSummary.total_meals + meals,
+        MonthSummary.total_bazar: MonthSummary.total_bazar + bazar,
+        MonthSummary.version: MonthSummary.version + 1,
+    }, synchronize_session=False)
+    if not updated:
+        rebuild_month_summary(month_id)
+        return
+    record_event(kind, month_id, user_id=user_id, day=day, meals=meals, deposit=deposit, bazar=bazar,
+                 detail=note)
+    update_daily_rollups(month_id, {day: (meals, bazar)})
+    if user_id is None:
+        return
+    updated = UserMonthBalance.query.filter_by(month_id=month_id, user_id=user_id).update({
+        UserMonthBalance.total_meal: UserMonthBalance.total_meal + meals,
+        UserMonthBalance.deposit: UserMonthBalance.deposit + deposit,
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(UserMonthBalance(month_id=month_id, user_id=user_id,
+                                        total_meal=meals, deposit=deposit))
+
+
+# Batched form of update_ledger for many users at once: meals and deposits
+# map user_id to a delta, days maps a date to its (meals, bazar) delta. One
+# summary UPDATE plus one executemany UPDATE for the balance rows, inserting
+# only the rows that don't exist yet. The ledger events are one per user
+# and kind (dated when there is a single day), plus one for the bazar.
+def update_ledger_batch(month_id, meals=None, deposits=None, bazar=0, days=None):
+    meals = {user_id: delta for user_id, delta in (meals or {}).items() if delta}
+    deposits = {user_id: delta for user_id, delta in (deposits or {}).items() if delta}
+    if month_id is None or not (meals or deposits or bazar):
+        return
+    db.session.flush()
+    updated = MonthSummary.query.filter_by(month_id=month_id).update({
+        MonthSummary.total_meals: MonthSummary.total_meals + sum(meals.values()),
+        MonthSummary.total_bazar: MonthSummary.total_bazar + bazar,
+        MonthSummary.version: MonthSummary.version + 1,
+    }, synchronize_session=False)
+    if not updated:
+        rebuild_month_summary(month_id)
+        return
+    day = next(iter(days)) if days and len(days) == 1 else None
+    for user_id, delta in meals.items():
+        record_event('meal', month_id, user_id=user_id, day=day, meals=delta)
+    for user_id, delta in deposits.items():
+        record_event('deposit', month_id, user_id=user_id, day=day, deposit=delta)
+    if bazar:
+        record_event('bazar', month_id, day=day, bazar=bazar)
+    update_daily_rollups(month_id, days or {})
+
+    user_ids = set(meals) | set(deposits)
+    if not user_ids:
+        return
+    existing = {user_id for (user_id,) in db.session.query(UserMonthBalance.user_id).filter(
+        UserMonthBalance.month_id == month_id, UserMonthBalance.user_id.in_(user_ids))}
+    if existing:
+        balances = UserMonthBalance.__table__
+        db.session.execute(
+            balances.update()
+            .where(balances.c.month_id == db.bindparam('m_id'), balances.c.user_id == db.bindparam('u_id'))
+            .values(total_meal=balances.c.total_meal + db.bindparam('meal_delta'),
+                    deposit=balances.c.deposit + db.bindparam('deposit_delta')),
+            [{'m_id': month_id, 'u_id': user_id, 'meal_delta': meals.get(user_id, 0),
+              'deposit_delta': deposits.get(user_id, 0)} for user_id in existing]
+        )
+    db.session.bulk_insert_mappings(UserMonthBalance, [
+        {'month_id': month_id, 'user_id': user_id,
+         'total_meal': meals.get(user_id, 0), 'deposit': deposits.get(user_id, 0)}
+        for user_id in user_ids - existing
+    ])
+
+
+# Stored summary for a month, built on first use
+def month_summary(month_id):
+    summary = db.session.get(MonthSummary, month_id)
+    if summary is None:
+        rebuild_month_summary(month_id)
+        db.session.commit()
+        summary = db.session.get(MonthSummary, month_id)
+    return summary
+
+
+# All of a mess's users with their stored totals for one of its months
+# (zeros when no entries), ordered by user id. Names come from the cached
+# roster.
+Balance = namedtuple('Balance', ['id', 'username', 'name', 'role', 'total_meal', 'deposit'])
+
+
+def user_balances(month_id, mess_id):
+    totals = {user_id: (total_meal, deposit) for user_id, total_meal, deposit in
+              db.session.query(UserMonthBalance.user_id, UserMonthBalance.total_meal,
+                               UserMonthBalance.deposit).filter_by(month_id=month_id)}
+    return [Balance(u.id, u.username, u.name, u.role, *totals.get(u.id, (0, ZERO)))
+            for u in get_roster(mess_id).by_id.values()]
+
+
+# ---------------- BULK MEALS ----------------
+# Write a whole day's meals in one transaction. entries maps user_id to
+# (morning, lunch, dinner); existing rows for that day are updated in
+# place, new non-zero rows are bulk-inserted. Returns (inserted, updated).
+def save_day_meals(month_id, day, entries):
+    existing = {m.user_id: m for m in Meal.query.filter_by(month_id=month_id, date=day)
+                .filter(Meal.user_id.in_(entries))}
+    inserts, updates, deltas = [], [], {}
+    for user_id, (morning, lunch, dinner) in entries.items():
+        meal = existing.get(user_id)
+        if meal is None:
+            if morning or lunch or dinner:
+                inserts.append({'date': day, 'user_id': user_id, 'month_id': month_id,
+                                'morning': morning, 'lunch': lunch, 'dinner': dinner})
+                deltas[user_id] = morning + lunch + dinner
+        elif (meal.morning, meal.lunch, meal.dinner) != (morning, lunch, dinner):
+            updates.append({'id': meal.id, 'morning': morning, 'lunch': lunch, 'dinner': dinner})
+            deltas[user_id] = (morning + lunch + dinner) - (meal.morning + meal.lunch + meal.dinner)
+
+    db.session.bulk_insert_mappings(Meal, inserts)
+    db.session.bulk_update_mappings(Meal, updates)
+    update_ledger_batch(month_id, meals=deltas, days={day: (sum(deltas.values()), 0)})
+    db.session.commit()
+    return len(inserts), len(updates)
@@ -0,0 +1,207 @@
+"""Drive the app through its main pages and report latency per route.
+
+With no DATABASE_URL a throwaway SQLite database is seeded with gen_data;
+otherwise the existing database is used (add --seed to regenerate it).
+
+    python loadtest.py --out before.json
+    python loadtest.py --out after.json --compare before.json
+    python loadtest.py --url http://127.0.0.1:8000 --users 500   # against gunicorn
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+THROWAWAY_DB = 'DATABASE_URL' not in os.environ
+if THROWAWAY_DB:
+    _tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + _tmp.name
+
+from app import create_app
+from gen_data import generate
+from models import db
+
+app = create_app()
+
+
+# ---------------- CLIENTS ----------------
+class LocalClient:
+    """In-process Flask test client."""
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Cookie-keeping HTTP client for a running server; redirects are not followed."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            return e.code
+
+
+# ---------------- SCENARIOS ----------------
+# (name, client role, method, path, form data for request i or None, expected status)
+def scenarios(users, rng):
+    future = date(2031, 1, 1)
+    return [
+        ('manager_dashboard', 'manager', 'GET', '/manager/dashboard', None, 200),
+        ('boarder_dashboard', 'boarder', 'GET', '/boarder/dashboard', None, 200),
+        ('view_meals', 'manager', 'GET', '/manager/view_meals', None, 200),
+        ('view_deposits', 'manager', 'GET', '/manager/view_deposits', None, 200),
+        ('view_bazar', 'manager', 'GET', '/manager/view_bazar', None, 200),
+        ('api_summary', 'boarder', 'GET', '/api/summary', None, 200),
+        ('add_meal', 'manager', 'POST', '/add_meal/', lambda i: {
+            'date': (future + timedelta(days=i)).isoformat(), 'user_id': rng.randint(1, users),
+            'morning': 1, 'lunch': 1, 'dinner': 1}, 302),
+        ('add_deposit', 'manager', 'POST', '/manager/add_deposit', lambda i: {
+            'date': future.isoformat(), 'user': rng.randint(1, users), 'amount': 500}, 302),
+        ('add_bazar', 'manager', 'POST', '/manager/add_bazar', lambda i: {
+            'date': future.isoformat(), 'description': 'Load test', 'cost': 250}, 302),
+    ]
+
+
+def percentile(samples, q):
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def summarize(samples, errors):
+    samples = sorted(samples)
+    total = sum(samples)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'mean_ms': total / len(samples) * 1000,
+        'p50_ms': percentile(samples, 0.50) * 1000,
+        'p95_ms': percentile(samples, 0.95) * 1000,
+        'p99_ms': percentile(samples, 0.99) * 1000,
+        'rps': len(samples) / total if total else 0,
+    }
+
+
+def timed_requests(client_factory, count, warmup, send):
+    samples, errors = [], 0
+    for i in range(warmup + count):
+        client = client_factory()
+        started = time.perf_counter()
+        ok = send(client, i)
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            samples.append(elapsed)
+            errors += not ok
+    return samples, errors
+
+
+def run(make_client, users, requests, login_requests, warmup, seed):
+    rng = random.Random(seed)
+
+    def logged_in(username):
+        client = make_client()
+        status = client.request('POST', '/login', {'username': username, 'password': 'bench'})
+        if status != 302:
+            raise SystemExit(f'login as {username} failed with HTTP {status}; was the data made by gen_data?')
+        return client
+
+    results = {}
+    samples, errors = timed_requests(
+        make_client, login_requests, min(warmup, 1),
+        lambda c, i: c.request('POST', '/login', {'username': 'user0', 'password': 'bench'}) == 302)
+    results['login'] = summarize(samples, errors)
+
+    clients = {'manager': logged_in('user0'), 'boarder': logged_in('user1')}
+    for name, role, method, path, data, expected in scenarios(users, rng):
+        client = clients[role]
+        samples, errors = timed_requests(
+            lambda: client, requests, warmup,
+            lambda c, i: c.request(method, path, data(i) if data else None) == expected)
+        results[name] = summarize(samples, errors)
+    return results
+
+
+# ---------------- REPORTING ----------------
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, previous=None):
+    print(f'{"route":18} {"reqs":>5} {"err":>4} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8}')
+    for name, r in results.items():
+        line = (f'{name:18} {r["requests"]:5d} {r["errors"]:4d} {r["p50_ms"]:8.2f} '
+                f'{r["p95_ms"]:8.2f} {r["p99_ms"]:8.2f} {r["rps"]:8.1f}')
+        before = (previous or {}).get(name)
+        if before:
+            line += f'   p95 {(r["p95_ms"] / before["p95_ms"] - 1) * 100:+6.1f}% vs baseline'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='base URL of a running server (default: in-process test client)')
+    parser.add_argument('--seed', action='store_true', help='regenerate DATABASE_URL with gen_data first')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--months', type=int, default=36)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--login-requests', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier --out file to compare against')
+    args = parser.parse_args()
+
+    with app.app_context():
+        if THROWAWAY_DB or args.seed:
+            counts = generate(args.users, args.months)
+            print(', '.join(f'{n} {name}' for name, n in counts.items()))
+        database = db.engine.url.get_backend_name()
+
+    make_client = (lambda: HttpClient(args.url)) if args.url else LocalClient
+    results = run(make_client, args.users, args.requests, args.login_requests, args.warmup, seed=1)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+
+    if args.out:
+        report = {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'database': database,
+            'target': args.url or 'test-client',
+            'dataset': {'users': args.users, 'months': args.months},
+            'results': results,
+        }
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {args.out}')
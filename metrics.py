@@ -0,0 +1,148 @@
+"""Opt-in request and SQL instrumentation.
+
+Enabled with METRICS_ENABLED=1. When disabled no hooks are installed, so
+requests and queries run exactly as before. Numbers are per worker process.
+"""
+import threading
+import time
+from collections import deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Latency histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class EndpointStats:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.n_plus_one = 0
+
+    def observe(self, seconds, queries, db_seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.queries += queries
+        self.db_seconds += db_seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    # Upper bound of the bucket holding the q-th quantile (None past 10s)
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.buckets):
+            seen += n
+            if seen >= target:
+                return bound
+        return None
+
+
+class Metrics:
+    def __init__(self, n_plus_one_threshold=10, keep_warnings=50):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.endpoints = {}
+        self.warnings = deque(maxlen=keep_warnings)
+        self.started = time.time()
+        self.enabled = False
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = True
+        self.logger = app.logger
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # ---------------- HOOKS ----------------
+    def _start_request(self):
+        g._metrics = {'started': time.perf_counter(), 'db_seconds': 0.0, 'statements': {}}
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['metrics_query_start'].pop()
+        if not has_request_context() or '_metrics' not in g:
+            return
+        current = g._metrics
+        current['db_seconds'] += time.perf_counter() - started
+        # statements are parameterized, so the SQL text is the template
+        current['statements'][statement] = current['statements'].get(statement, 0) + 1
+
+    def _finish_request(self, exc=None):
+        current = g.pop('_metrics', None)
+        if current is None:
+            return
+        elapsed = time.perf_counter() - current['started']
+        endpoint = request.endpoint or 'unmatched'
+        repeated = [(sql, n) for sql, n in current['statements'].items()
+                    if n >= self.n_plus_one_threshold]
+
+        with self._lock:
+            stats = self.endpoints.setdefault(endpoint, EndpointStats())
+            stats.observe(elapsed, sum(current['statements'].values()), current['db_seconds'])
+            stats.n_plus_one += bool(repeated)
+            for sql, n in repeated:
+                self.warnings.append((time.time(), endpoint, n, ' '.join(sql.split())[:300]))
+        for sql, n in repeated:
+            self.logger.warning("Possible N+1 in %s: statement ran %d times: %s",
+                                endpoint, n, ' '.join(sql.split())[:200])
+
+    # ---------------- OUTPUT ----------------
+    def snapshot(self):
+        with self._lock:
+            rows = []
+            for endpoint, s in sorted(self.endpoints.items()):
+                rows.append({
+                    'endpoint': endpoint,
+                    'requests': s.count,
+                    'avg_ms': s.seconds / s.count * 1000,
+                    'p50_ms': _ms(s.quantile(0.5)),
+                    'p95_ms': _ms(s.quantile(0.95)),
+                    'p99_ms': _ms(s.quantile(0.99)),
+                    'queries_per_request': s.queries / s.count,
+                    'db_ms_per_request': s.db_seconds / s.count * 1000,
+                    'n_plus_one': s.n_plus_one,
+                })
+            return rows, list(reversed(self.warnings))
+
+    def prometheus(self):
+        lines = [
+            '# HELP easymess_request_duration_seconds Request latency by endpoint.',
+            '# TYPE easymess_request_duration_seconds histogram',
+        ]
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            for endpoint, s in endpoints:
+                label = f'endpoint="{endpoint}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS, s.buckets):
+                    cumulative += n
+                    lines.append(f'easymess_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'easymess_request_duration_seconds_bucket{{{label},le="+Inf"}} {s.count}')
+                lines.append(f'easymess_request_duration_seconds_sum{{{label}}} {s.seconds:.6f}')
+                lines.append(f'easymess_request_duration_seconds_count{{{label}}} {s.count}')
+            for name, help_text, attr, fmt in (
+                ('easymess_db_queries_total', 'SQL statements executed, by endpoint.', 'queries', '{}'),
+                ('easymess_db_seconds_total', 'Time spent in SQL statements, by endpoint.', 'db_seconds', '{:.6f}'),
+                ('easymess_n_plus_one_total', 'Requests repeating one statement past the N+1 threshold.',
+                 'n_plus_one', '{}'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, s in endpoints:
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} ' + fmt.format(getattr(s, attr)))
+        return '\n'.join(lines) + '\n'
+
+
+def _ms(seconds):
+    return seconds * 1000 if seconds is not None else None
@@ -0,0 +1,239 @@
+from flask_sqlalchemy import SQLAlchemy
+from flask_login import UserMixin
+from datetime import date
+
+db = SQLAlchemy()
+
+
+# ---------------- MODELS ----------------
+# One hostel. Users and months belong to a mess; meals, deposits, bazar and
+# everything derived from them belong to it through their month.
+class Mess(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(150), unique=True, nullable=False)
+
+
+# Databases from before messes existed put everything in this one
+DEFAULT_MESS_ID = 1
+
+
+class User(UserMixin, db.Model):
+    __table_args__ = (
+        db.Index('ix_user_mess_id', 'mess_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    mess_id = db.Column(db.Integer, db.ForeignKey('mess.id'), nullable=False,
+                        default=DEFAULT_MESS_ID, server_default=str(DEFAULT_MESS_ID))
+    name = db.Column(db.String(150))
+    username = db.Column(db.String(150), unique=True)
+    password = db.Column(db.String(256))
+    role = db.Column(db.String(20))
+    email = db.Column(db.String(150), unique=True)
+    first_login = db.Column(db.Boolean, default=True)  # new field
+
+
+class Month(db.Model):
+    __table_args__ = (
+        db.Index('ix_month_mess_active', 'mess_id', 'is_active', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    mess_id = db.Column(db.Integer, db.ForeignKey('mess.id'), nullable=False,
+                        default=DEFAULT_MESS_ID, server_default=str(DEFAULT_MESS_ID))
+    name = db.Column(db.String(50))
+    is_active = db.Column(db.Boolean, default=True)
+
+
+class Meal(db.Model):
+    __table_args__ = (
+        db.Index('ix_meal_month_user', 'month_id', 'user_id'),
+        db.Index('ix_meal_month_date', 'month_id', 'date'),
+        # one row per user per day; a unique index (rather than a table
+        # constraint) so `upgrade-db` can add it to existing SQLite tables
+        db.Index('uq_meal_user_date_month', 'user_id', 'date', 'month_id', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+
+    # Link to any user
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user = db.relationship('User', backref='meals')  # gives access: user.meals
+
+    morning = db.Column(db.Integer, default=0)
+    lunch = db.Column(db.Integer, default=0)
+    dinner = db.Column(db.Integer, default=0)
+
+    # Link to Month
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), nullable=False)
+    month = db.relationship('Month', backref='meals')
+
+
+
+
+class Deposit(db.Model):
+    __table_args__ = (
+        db.Index('ix_deposit_month_user', 'month_id', 'boarder_id'),
+        db.Index('ix_deposit_month_date', 'month_id', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), nullable=False)
+    
+    boarder_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # FK to User
+    amount = db.Column(db.Numeric(12, 2), nullable=False)
+
+    # ✅ Add relationship so you can access deposit.user.name
+    user = db.relationship('User', backref='deposits')
+
+
+
+
+
+
+class Bazar(db.Model):
+    __table_args__ = (
+        db.Index('ix_bazar_month_date', 'month_id', 'date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, default=date.today)
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'))
+    description = db.Column(db.String(100))
+    cost = db.Column(db.Numeric(12, 2))
+
+
+# ---------------- LEDGER SUMMARY ----------------
+# Running totals per month, updated in the same transaction as every
+# Meal / Deposit / Bazar write so dashboards never rescan the raw rows.
+class MonthSummary(db.Model):
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    total_bazar = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    total_meals = db.Column(db.Integer, nullable=False, default=0)
+    # bumped on every ledger change; API ETags are derived from it
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class UserMonthBalance(db.Model):
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_meal = db.Column(db.Integer, nullable=False, default=0)
+    deposit = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+# ---------------- CACHE VERSIONS ----------------
+# Counters bumped in the same transaction as a change to cached data, so
+# every worker can tell its copy is stale with one primary-key read.
+# Per-mess caches use one row per mess, e.g. "roster:3".
+class CacheVersion(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+# ---------------- MONTH CLOSE ----------------
+# Frozen report for a finished month, written once by the month-close
+# worker (closing.py) and never updated afterwards. status moves
+# pending -> running -> done, or failed with the error kept for a retry.
+class MonthClose(db.Model):
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    error = db.Column(db.Text)
+    requested_at = db.Column(db.DateTime)
+    closed_at = db.Column(db.DateTime)
+    total_bazar = db.Column(db.Numeric(12, 2))
+    total_meals = db.Column(db.Integer)
+    meal_rate = db.Column(db.Numeric(12, 2))
+    # MonthSummary.version at close; a later version means entries changed since
+    ledger_version = db.Column(db.Integer)
+
+
+class MonthCloseBalance(db.Model):
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    # no foreign key: the report outlives users deleted later
+    user_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(150))
+    username = db.Column(db.String(150))
+    role = db.Column(db.String(20))
+    total_meal = db.Column(db.Integer, nullable=False, default=0)
+    deposit = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    meal_cost = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    balance = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    # carried in from the previous closed month, and out to the next one
+    brought_forward = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    carry_forward = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+# ---------------- DAILY ROLLUPS ----------------
+# Meals eaten and bazar spent per day, kept current with the ledger, so
+# analytics over years read one row per day instead of every raw entry.
+# The month's mess is copied onto each row for the analytics index.
+class DailyRollup(db.Model):
+    __table_args__ = (
+        db.Index('ix_daily_rollup_mess_day', 'mess_id', 'day'),
+    )
+
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    # no Python default: every writer passes its month's mess. The server
+    # default only lets `upgrade-db` add the column to existing rows.
+    mess_id = db.Column(db.Integer, db.ForeignKey('mess.id'), nullable=False,
+                        server_default=str(DEFAULT_MESS_ID))
+    meals = db.Column(db.Integer, nullable=False, default=0)
+    bazar = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+# ---------------- OFFLINE SYNC ----------------
+# Entries saved through /api/sync, keyed by the id the phone gave them, so
+# a batch sent again after a dropped response is not applied twice.
+class SyncedEntry(db.Model):
+    client_id = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    synced_by = db.Column(db.Integer)  # user who sent it; no FK so deleting users keeps the key
+    synced_at = db.Column(db.DateTime, nullable=False)
+
+
+# ---------------- LEDGER EVENTS ----------------
+# Append-only record of every change to the ledger (meal, deposit and
+# bazar deltas, plus "adjust" rows when rebuild-ledger corrects drift) and
+# of user and month changes. Rows are never updated; mess_id and month_id
+# have no foreign keys so the history outlives deleted months. Zero deltas
+# are stored as NULL. Written in batches by events.py at commit.
+class LedgerEvent(db.Model):
+    __table_args__ = (
+        db.Index('ix_ledger_event_month', 'month_id', 'id'),
+        db.Index('ix_ledger_event_mess', 'mess_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    at = db.Column(db.DateTime, nullable=False)
+    mess_id = db.Column(db.Integer)
+    month_id = db.Column(db.Integer)
+    actor_id = db.Column(db.Integer)  # user who made the change; NULL from the command line
+    kind = db.Column(db.String(16), nullable=False)
+    user_id = db.Column(db.Integer)
+    day = db.Column(db.Date)
+    meals = db.Column(db.Integer)
+    deposit = db.Column(db.Numeric(12, 2))
+    bazar = db.Column(db.Numeric(12, 2))
+    detail = db.Column(db.String(150))
+
+
+# A month's totals and balances as of one event (ledger state once that
+# event and every earlier one are applied), so a point-in-time lookup
+# replays at most LEDGER_CHECKPOINT_EVERY events.
+class LedgerCheckpoint(db.Model):
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    event_id = db.Column(db.Integer, primary_key=True)
+    at = db.Column(db.DateTime, nullable=False)
+    total_bazar = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+    total_meals = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LedgerCheckpointBalance(db.Model):
+    month_id = db.Column(db.Integer, db.ForeignKey('month.id'), primary_key=True)
+    event_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, primary_key=True)
+    total_meal = db.Column(db.Integer, nullable=False, default=0)
+    deposit = db.Column(db.Numeric(12, 2), nullable=False, default=0)
@@ -1,17 +1,22 @@
-from app import db, User
-from werkzeug.security import generate_password_hash
-from app import app
+from models import db, DEFAULT_MESS_ID, User
+from ledger import invalidate_roster
+from tenancy import ensure_default_mess
+from auth import hash_password
+from app import create_app
+
+app = create_app()
 
 with app.app_context():
     db.create_all()  # ensure tables exist
+    ensure_default_mess()
 
     # Add default manager
-    manager_pw = generate_password_hash("manager123")  # no 'method' needed
+    manager_pw = hash_password("manager123")
     manager = User(name="Main Manager", username="manager1", password=manager_pw, role="manager", first_login=True)
     
     # Add sample boarders
-    boarder1_pw = generate_password_hash("boarder123")
-    boarder2_pw = generate_password_hash("boarder123")
+    boarder1_pw = hash_password("boarder123")
+    boarder2_pw = hash_password("boarder123")
     boarder1 = User(name="Boarder One", username="boarder1", password=boarder1_pw, role="boarder", first_login=True)
     boarder2 = User(name="Boarder Two", username="boarder2", password=boarder2_pw, role="boarder", first_login=True)
 
@@ -19,6 +24,7 @@ with app.app_context():
     db.session.add(manager)
     db.session.add(boarder1)
     db.session.add(boarder2)
+    invalidate_roster(DEFAULT_MESS_ID)
     db.session.commit()
 
     print("Default manager and sample boarders added successfully!")
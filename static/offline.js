@@ -0,0 +1,181 @@
+// Offline entry page: entries are queued in localStorage with an id made
+// here, and posted to /api/sync in batches whenever there is a connection.
+// The server records saved ids, so resending a batch after a lost response
+// never saves an entry twice. Only network errors and 5xx responses are
+// retried; entries the server refuses are set aside with the reason, so
+// they never hold up the rest of the queue.
+(function () {
+  var QUEUE = 'mess-sync-queue';
+  var REJECTED = 'mess-sync-rejected';
+  var BATCH = 100;
+  var page = document.getElementById('offline-entry');
+  var status = document.getElementById('sync-status');
+  var syncing = false;
+
+  function load(key) {
+    try {
+      return JSON.parse(localStorage.getItem(key)) || [];
+    } catch (e) {
+      return [];
+    }
+  }
+
+  function save(key, items) {
+    localStorage.setItem(key, JSON.stringify(items));
+  }
+
+  function newId() {
+    if (window.crypto && crypto.randomUUID) {
+      return crypto.randomUUID();
+    }
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+  }
+
+  function userName(id) {
+    var option = document.querySelector('select[name="user"] option[value="' + id + '"]');
+    return option ? option.textContent : 'user ' + id;
+  }
+
+  function describe(entry) {
+    if (entry.kind === 'meals') {
+      return userName(entry.user) + ': ' + entry.morning + ' / ' + entry.lunch + ' / ' + entry.dinner;
+    }
+    if (entry.kind === 'deposits') {
+      return userName(entry.user) + ' deposited ' + entry.amount;
+    }
+    return entry.description + ': ' + entry.cost;
+  }
+
+  function row(entry, note, discard) {
+    var tr = document.createElement('tr');
+    [entry.date, entry.kind, describe(entry), note].forEach(function (text) {
+      var td = document.createElement('td');
+      td.textContent = text;
+      tr.appendChild(td);
+    });
+    var td = document.createElement('td');
+    if (discard) {
+      var button = document.createElement('button');
+      button.type = 'button';
+      button.className = 'btn btn-sm btn-outline-danger';
+      button.textContent = 'Discard';
+      button.addEventListener('click', discard);
+      td.appendChild(button);
+    }
+    tr.appendChild(td);
+    return tr;
+  }
+
+  function render(message) {
+    var queue = load(QUEUE);
+    var rejected = load(REJECTED);
+    var body = document.getElementById('sync-queue');
+    body.textContent = '';
+    queue.forEach(function (entry) {
+      body.appendChild(row(entry, 'waiting'));
+    });
+    rejected.forEach(function (entry) {
+      body.appendChild(row(entry, 'not saved: ' + entry.error, function () {
+        save(REJECTED, load(REJECTED).filter(function (e) { return e.client_id !== entry.client_id; }));
+        render();
+      }));
+    });
+    status.textContent = message || ((queue.length ? queue.length + ' waiting to sync.' : 'Everything is saved.') +
+      (rejected.length ? ' ' + rejected.length + ' not saved, see below.' : ''));
+  }
+
+  function setAside(entries, error) {
+    var rejected = load(REJECTED);
+    var ids = {};
+    entries.forEach(function (entry) {
+      entry.error = error || entry.error;
+      ids[entry.client_id] = true;
+      rejected.push(entry);
+    });
+    save(REJECTED, rejected);
+    save(QUEUE, load(QUEUE).filter(function (entry) { return !ids[entry.client_id]; }));
+  }
+
+  function sync() {
+    var batch = load(QUEUE).slice(0, BATCH);
+    if (syncing || !batch.length) {
+      render();
+      return;
+    }
+    syncing = true;
+    fetch(page.dataset.syncUrl, {
+      method: 'POST',
+      credentials: 'same-origin',
+      headers: {'Content-Type': 'application/json', 'Accept': 'application/json'},
+      body: JSON.stringify({entries: batch})
+    }).then(function (response) {
+      var type = response.headers.get('Content-Type') || '';
+      if (response.redirected || response.status === 401) {
+        throw new Error('Logged out: log in again to sync.');
+      }
+      if (response.status >= 500 || response.status === 409) {
+        throw new Error('Server busy (HTTP ' + response.status + '), will retry.');
+      }
+      if (!response.ok) {
+        // the request itself was refused: sending it again would only fail again
+        return response.json().catch(function () { return {}; }).then(function (data) {
+          setAside(batch, data.error || 'refused (HTTP ' + response.status + ')');
+          return {results: []};
+        });
+      }
+      if (type.indexOf('application/json') === -1) {
+        throw new Error('Logged out: log in again to sync.');
+      }
+      return response.json();
+    }).then(function (data) {
+      var done = {};
+      var refused = [];
+      var waiting = 0;
+      data.results.forEach(function (result) {
+        if (result.status === 'waiting') {
+          waiting += 1;
+        } else {
+          done[result.client_id] = result;
+        }
+      });
+      batch.forEach(function (entry) {
+        var result = done[entry.client_id];
+        if (result && result.status === 'rejected') {
+          entry.error = result.error;
+          refused.push(entry);
+        }
+      });
+      setAside(refused);
+      save(QUEUE, load(QUEUE).filter(function (entry) { return !done[entry.client_id]; }));
+      syncing = false;
+      if (waiting && waiting === data.results.length) {
+        render(waiting + ' waiting for a month to be started.');
+        return;
+      }
+      sync();
+    }).catch(function (error) {
+      syncing = false;
+      render(error instanceof TypeError ? 'Offline: entries are kept on this phone.' : error.message);
+    });
+  }
+
+  document.querySelectorAll('form[data-kind]').forEach(function (form) {
+    form.addEventListener('submit', function (event) {
+      event.preventDefault();
+      var entry = {client_id: newId(), kind: form.dataset.kind, month: page.dataset.monthId};
+      new FormData(form).forEach(function (value, name) { entry[name] = value; });
+      var queue = load(QUEUE);
+      queue.push(entry);
+      save(QUEUE, queue);
+      form.querySelectorAll('input[type="number"], input[type="text"]').forEach(function (input) {
+        input.value = input.defaultValue;
+      });
+      sync();
+    });
+  });
+
+  document.getElementById('sync-now').addEventListener('click', sync);
+  window.addEventListener('online', sync);
+  setInterval(sync, 30000);
+  sync();
+})();
@@ -0,0 +1,93 @@
+"""Batched, idempotent saves from the offline entry page.
+
+The page queues meal, deposit and bazar entries on the phone, each with an
+id it generates itself, and posts them to /api/sync whenever it has a
+connection. Entries use the CSV import's fields and checks, and are saved
+with the import's batch insert. Every saved id is recorded in the same
+transaction, so an entry sent twice (a retry after the response was lost)
+is reported as a duplicate instead of being saved again.
+"""
+from datetime import datetime, timezone
+
+from models import db, Month, SyncedEntry
+from ledger import get_roster
+from transfer import IMPORT_COLUMNS, parse_import_row, import_batch
+
+MAX_SYNC_ENTRIES = 500
+MAX_CLIENT_ID = 64
+
+
+# Save a list of entry dicts ({client_id, kind, date, ...} with the import
+# columns for that kind, plus an optional month name or id) into a mess's
+# months and commit.
+# Returns one {client_id, status[, error]} per entry, in order; status is
+# "saved", "duplicate", "rejected" or "waiting" (no month given while the
+# mess has no active month: send it again once one is started). An id only counts as seen once an
+# entry carrying it is saved, so a rejected entry can be resent fixed in
+# the same batch. A concurrent sync of the same ids makes the commit fail
+# with IntegrityError; retrying reports them as duplicates.
+def sync_entries(entries, synced_by, mess_id, default_month_id=None):
+    results = [None] * len(entries)
+    ids = [entry.get('client_id') if isinstance(entry, dict) else None for entry in entries]
+    valid = {i for i, client_id in enumerate(ids)
+             if isinstance(client_id, str) and 0 < len(client_id) <= MAX_CLIENT_ID}
+    known = {client_id for (client_id,) in db.session.query(SyncedEntry.client_id)
+             .filter(SyncedEntry.client_id.in_({ids[i] for i in valid}))} if valid else set()
+
+    users = {}
+    for user in get_roster(mess_id).by_id.values():
+        users[str(user.id)] = user.id
+        users[user.username] = user.id
+    months = {}
+    for month_id, name in db.session.query(Month.id, Month.name).filter(Month.mess_id == mess_id):
+        months[str(month_id)] = month_id
+        months[name] = month_id
+
+    def reject(i, reason):
+        results[i] = {'client_id': ids[i], 'status': 'rejected', 'error': reason}
+
+    # An id seen again while its first entry is still queued waits for the
+    # next round: a duplicate if that entry was saved, processed otherwise.
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    pending = range(len(entries))
+    while pending:
+        batches, queued, deferred = {}, set(), []
+        for i in pending:
+            entry = entries[i]
+            if i not in valid:
+                reject(i, f"client_id must be a string of 1-{MAX_CLIENT_ID} characters")
+                continue
+            if ids[i] in known:
+                results[i] = {'client_id': ids[i], 'status': 'duplicate'}
+                continue
+            if ids[i] in queued:
+                deferred.append(i)
+                continue
+            kind = entry.get('kind')
+            if not isinstance(kind, str) or kind not in IMPORT_COLUMNS:
+                reject(i, f"unknown kind {kind!r}")
+                continue
+            missing = [c for c in IMPORT_COLUMNS[kind] if c not in entry]
+            if missing:
+                reject(i, f"missing field(s): {', '.join(missing)}")
+                continue
+            row = {k: '' if v is None else str(v) for k, v in entry.items()}
+            if default_month_id is None and not row.get('month', '').strip():
+                results[i] = {'client_id': ids[i], 'status': 'waiting', 'error': "no active month"}
+                continue
+            try:
+                record = parse_import_row(kind, row, users, months, default_month_id)
+            except (KeyError, TypeError, ValueError) as e:
+                reject(i, str(e))
+                continue
+            batches.setdefault(kind, []).append((i, record))
+            queued.add(ids[i])
+
+        for kind, batch in batches.items():
+            for i in import_batch(kind, batch, reject):
+                db.session.add(SyncedEntry(client_id=ids[i], kind=kind, synced_by=synced_by, synced_at=now))
+                results[i] = {'client_id': ids[i], 'status': 'saved'}
+                known.add(ids[i])
+        pending = deferred
+    db.session.commit()
+    return results
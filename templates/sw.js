@@ -0,0 +1,79 @@
+// Service worker: keeps Bootstrap, the files in static/ and the offline
+// entry page cached so the app opens without waiting on the network.
+// Rendered by the service_worker view; the cache name changes whenever
+// static/ does, and older caches are dropped on activate.
+var CACHE = 'mess-{{ version }}';
+var PRECACHE = {{ precache|tojson }};
+var ENTRY_PAGE = {{ entry_page|tojson }};
+var LOGOUT = {{ logout|tojson }};
+var STATIC_PREFIX = {{ static_prefix|tojson }};
+
+self.addEventListener('install', function (event) {
+  event.waitUntil(caches.open(CACHE).then(function (cache) {
+    return cache.addAll(PRECACHE);
+  }).then(function () {
+    return self.skipWaiting();
+  }));
+});
+
+self.addEventListener('activate', function (event) {
+  event.waitUntil(caches.keys().then(function (names) {
+    return Promise.all(names.filter(function (name) {
+      return name.indexOf('mess-') === 0 && name !== CACHE;
+    }).map(function (name) {
+      return caches.delete(name);
+    }));
+  }).then(function () {
+    return self.clients.claim();
+  }));
+});
+
+// Pages: network first. The entry page is kept for offline use (never a
+// redirect to the login page), and forgotten on logout. Without a
+// connection any page falls back to the entry page.
+function page(request) {
+  var path = new URL(request.url).pathname;
+  return fetch(request).then(function (response) {
+    if (path === ENTRY_PAGE && response.ok && !response.redirected) {
+      var copy = response.clone();
+      caches.open(CACHE).then(function (cache) { cache.put(ENTRY_PAGE, copy); });
+    } else if (path === LOGOUT) {
+      caches.open(CACHE).then(function (cache) { cache.delete(ENTRY_PAGE); });
+    }
+    return response;
+  }).catch(function () {
+    return caches.match(ENTRY_PAGE).then(function (cached) {
+      return cached || new Response('You are offline.', {status: 503, headers: {'Content-Type': 'text/plain'}});
+    });
+  });
+}
+
+// Static files and Bootstrap: answer from the cache straight away and
+// refresh the copy in the background.
+function asset(request) {
+  return caches.open(CACHE).then(function (cache) {
+    return cache.match(request).then(function (cached) {
+      var network = fetch(request).then(function (response) {
+        if (response.ok || response.type === 'opaque') {
+          cache.put(request, response.clone());
+        }
+        return response;
+      });
+      return cached || network;
+    });
+  });
+}
+
+self.addEventListener('fetch', function (event) {
+  var request = event.request;
+  if (request.method !== 'GET') {
+    return;
+  }
+  var url = new URL(request.url);
+  if (request.mode === 'navigate' && url.origin === self.location.origin) {
+    event.respondWith(page(request));
+  } else if ((url.origin === self.location.origin && url.pathname.indexOf(STATIC_PREFIX) === 0) ||
+             PRECACHE.indexOf(request.url) !== -1) {
+    event.respondWith(asset(request));
+  }
+});
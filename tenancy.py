@@ -0,0 +1,203 @@
+"""Messes (hostels) sharing one deployment.
+
+Every user and month belongs to one mess; meals, deposits, bazar and the
+summaries built from them belong to it through their month. Usernames stay
+unique across the deployment, so logging in never asks which mess.
+
+A mess moves between databases as JSON lines: `flask --app app export-mess`
+writes its users, months and entries, and `import-mess` loads them into
+another database under fresh ids, then rebuilds the summaries and closing
+reports there instead of copying them. The ledger event history stays
+behind: in the new database each month's log starts with the imported
+totals as "adjust" events.
+"""
+import json
+from datetime import date
+from decimal import Decimal
+
+from models import (db, DEFAULT_MESS_ID, Mess, User, Month, Meal, Deposit, Bazar, MonthSummary,
+                    UserMonthBalance, MonthClose, MonthCloseBalance, DailyRollup, SyncedEntry, CacheVersion,
+                    LedgerEvent, LedgerCheckpoint, LedgerCheckpointBalance)
+from ledger import (rebuild_month_summary, invalidate_roster, invalidate_active_month, parse_amount,
+                    roster_key)
+from closing import close_month
+
+EXPORT_BATCH = 1000
+IMPORT_BATCH = 5000
+
+
+# ---------------- MESSES ----------------
+# Databases from before messes existed (and fresh ones) get the mess that
+# the mess_id column defaults to. Call before adding the mess_id columns.
+def ensure_default_mess():
+    if db.session.query(Mess.id).first() is not None:
+        return None
+    mess = Mess(id=DEFAULT_MESS_ID, name='Main Mess')
+    db.session.add(mess)
+    db.session.flush()
+    if db.engine.dialect.name == 'postgresql':
+        # an explicit id does not advance the id sequence
+        db.session.execute(db.text("SELECT setval(pg_get_serial_sequence('mess', 'id'), "
+                                   "(SELECT max(id) FROM mess))"))
+    db.session.commit()
+    return mess
+
+
+# New mess with its first manager, who picks a new password on first login
+def create_mess(name, username, password_hash):
+    if Mess.query.filter_by(name=name).first():
+        raise ValueError(f"a mess named {name!r} already exists")
+    if User.query.filter_by(username=username).first():
+        raise ValueError(f"username {username!r} is taken")
+    mess = Mess(name=name)
+    db.session.add(mess)
+    db.session.flush()
+    db.session.add(User(mess_id=mess.id, name=username, username=username, password=password_hash,
+                        role='manager', first_login=True))
+    invalidate_roster(mess.id)
+    db.session.commit()
+    return mess
+
+
+# Remove a mess and everything in it, its ledger events included
+def delete_mess(mess_id):
+    month_ids = db.session.query(Month.id).filter(Month.mess_id == mess_id).scalar_subquery()
+    user_ids = db.session.query(User.id).filter(User.mess_id == mess_id).scalar_subquery()
+    for model in (MonthCloseBalance, MonthClose, DailyRollup, UserMonthBalance, MonthSummary,
+                  LedgerCheckpointBalance, LedgerCheckpoint, Meal, Deposit, Bazar):
+        model.query.filter(model.month_id.in_(month_ids)).delete(synchronize_session=False)
+    SyncedEntry.query.filter(SyncedEntry.synced_by.in_(user_ids)).delete(synchronize_session=False)
+    LedgerEvent.query.filter_by(mess_id=mess_id).delete(synchronize_session=False)
+    Month.query.filter_by(mess_id=mess_id).delete(synchronize_session=False)
+    User.query.filter_by(mess_id=mess_id).delete(synchronize_session=False)
+    CacheVersion.query.filter_by(name=roster_key(mess_id)).delete(synchronize_session=False)
+    Mess.query.filter_by(id=mess_id).delete(synchronize_session=False)
+    db.session.commit()
+    invalidate_active_month(mess_id)
+
+
+# ---------------- EXPORT ----------------
+# One JSON object per line: the mess, then its users, months, meals,
+# deposits and bazar, each tagged with "type". Ids are the source
+# database's and are only used to link the rows to each other.
+def _json_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def export_mess(mess_id):
+    mess = db.session.get(Mess, mess_id)
+    if mess is None:
+        raise ValueError(f"no mess with id {mess_id}")
+    yield json.dumps({'type': 'mess', 'name': mess.name}) + '\n'
+
+    month_ids = db.session.query(Month.id).filter(Month.mess_id == mess_id).scalar_subquery()
+    queries = [
+        ('user', db.session.query(User.id, User.name, User.username, User.password, User.role,
+                                  User.first_login).filter(User.mess_id == mess_id).order_by(User.id)),
+        ('month', db.session.query(Month.id, Month.name, Month.is_active)
+         .filter(Month.mess_id == mess_id).order_by(Month.id)),
+        ('meal', db.session.query(Meal.month_id, Meal.user_id, Meal.date, Meal.morning, Meal.lunch,
+                                  Meal.dinner).filter(Meal.month_id.in_(month_ids)).order_by(Meal.id)),
+        ('deposit', db.session.query(Deposit.month_id, Deposit.boarder_id, Deposit.date, Deposit.amount)
+         .filter(Deposit.month_id.in_(month_ids)).order_by(Deposit.id)),
+        ('bazar', db.session.query(Bazar.month_id, Bazar.date, Bazar.description, Bazar.cost)
+         .filter(Bazar.month_id.in_(month_ids)).order_by(Bazar.id)),
+    ]
+    for kind, query in queries:
+        for row in query.yield_per(EXPORT_BATCH):
+            line = {'type': kind}
+            line.update((k, _json_value(v)) for k, v in row._asdict().items())
+            yield json.dumps(line) + '\n'
+
+
+# ---------------- IMPORT ----------------
+# Load an export_mess() stream as a new mess, optionally under another
+# name, in one transaction. Raises ValueError (and writes nothing) if the
+# name or any username is already taken here, or on a malformed line.
+# Returns the new Mess.
+def import_mess(lines, name=None):
+    mess, users, months = None, {}, {}
+    pending = {Meal: [], Deposit: [], Bazar: []}
+
+    def flush(model):
+        if pending[model]:
+            db.session.execute(model.__table__.insert(), pending[model])
+            pending[model] = []
+
+    def add(model, row):
+        pending[model].append(row)
+        if len(pending[model]) >= IMPORT_BATCH:
+            flush(model)
+
+    try:
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+                kind = row['type']
+                if mess is None and kind != 'mess':
+                    raise ValueError("the first line must describe the mess")
+                if kind == 'mess':
+                    if mess is not None:
+                        raise ValueError("more than one mess")
+                    mess_name = name or row['name']
+                    if Mess.query.filter_by(name=mess_name).first():
+                        raise ValueError(f"a mess named {mess_name!r} already exists")
+                    mess = Mess(name=mess_name)
+                    db.session.add(mess)
+                    db.session.flush()
+                elif kind == 'user':
+                    if User.query.filter_by(username=row['username']).first():
+                        raise ValueError(f"username {row['username']!r} is taken")
+                    user = User(mess_id=mess.id, name=row['name'], username=row['username'],
+                                password=row['password'], role=row['role'], first_login=row['first_login'])
+                    db.session.add(user)
+                    db.session.flush()
+                    users[row['id']] = user.id
+                elif kind == 'month':
+                    month = Month(mess_id=mess.id, name=row['name'], is_active=row['is_active'])
+                    db.session.add(month)
+                    db.session.flush()
+                    months[row['id']] = month.id
+                elif kind == 'meal':
+                    add(Meal, {'month_id': months[row['month_id']], 'user_id': users[row['user_id']],
+                               'date': date.fromisoformat(row['date']), 'morning': row['morning'],
+                               'lunch': row['lunch'], 'dinner': row['dinner']})
+                elif kind == 'deposit':
+                    add(Deposit, {'month_id': months[row['month_id']], 'boarder_id': users[row['boarder_id']],
+                                  'date': date.fromisoformat(row['date']),
+                                  'amount': parse_amount(row['amount'], allow_negative=True)})
+                elif kind == 'bazar':
+                    add(Bazar, {'month_id': months[row['month_id']],
+                                'date': date.fromisoformat(row['date']) if row['date'] else None,
+                                'description': row['description'],
+                                'cost': parse_amount(row['cost'], allow_negative=True)
+                                if row['cost'] is not None else None})
+                else:
+                    raise ValueError(f"unknown type {kind!r}")
+            except (KeyError, TypeError, ValueError) as e:
+                if isinstance(e, KeyError):
+                    e = f"unknown or missing {e}"
+                raise ValueError(f"line {number}: {e}") from None
+        if mess is None:
+            raise ValueError("empty export")
+        for model in pending:
+            flush(model)
+        for month_id in months.values():
+            rebuild_month_summary(month_id)
+        invalidate_roster(mess.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # reports are rebuilt here rather than copied; carry-forwards follow
+    for month_id in sorted(months.values()):
+        if not db.session.get(Month, month_id).is_active:
+            close_month(month_id)
+    return mess
@@ -0,0 +1,43 @@
+"""Shared fixtures: the app on a throwaway SQLite file seeded by gen_data.
+
+DATABASE_URL is always replaced, since generate() drops every table.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+os.environ['DATABASE_URL'] = 'sqlite:///' + _tmp.name
+# cheap hashes keep the per-user logins fast; month closes run inline
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+os.environ['MONTH_CLOSE_WORKERS'] = '0'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from gen_data import generate  # noqa: E402
+from models import db, DEFAULT_MESS_ID, Month  # noqa: E402
+
+
+# Two months of 40 users, user0 the manager; everyone's password is "bench"
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        generate(users=40, months=2, days=10, attendance=0.8)
+        yield app
+    os.unlink(_tmp.name)
+
+
+# The seeded mess's active month (tests may start months in other messes)
+@pytest.fixture(scope='session')
+def month_id(app):
+    return db.session.query(Month.id).filter_by(mess_id=DEFAULT_MESS_ID, is_active=True).scalar()
+
+
+def login(app, username):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': 'bench'})
+    return client
@@ -0,0 +1,35 @@
+import io
+
+import pytest
+
+from conftest import login
+from ledger import parse_amount
+from models import db, Bazar, DEFAULT_MESS_ID
+from sync import sync_entries
+from transfer import import_csv
+
+
+@pytest.mark.parametrize('text', ['10.555', 'abc', 'nan', '10000000000', '-33.10'])
+def test_bad_amounts_are_refused_everywhere(app, month_id, text):
+    with pytest.raises(ValueError):
+        parse_amount(text)
+
+    bazar_rows = Bazar.query.count()
+    page = login(app, 'user0').post('/manager/add_bazar', data={
+        'date': '2030-01-01', 'description': 'Fish', 'cost': text}, follow_redirects=True)
+    assert page.status_code == 200 and b'not saved' in page.data
+
+    result = import_csv('bazar', io.StringIO(f'date,description,cost\n2030-01-01,Fish,{text}\n'),
+                        DEFAULT_MESS_ID, month_id)
+    assert (result['imported'], result['rejected_count']) == (0, 1)
+
+    synced = sync_entries([{'client_id': f'amount-{text}', 'kind': 'bazar', 'date': '2030-01-01',
+                            'description': 'Fish', 'cost': text}], None, DEFAULT_MESS_ID, month_id)
+    assert synced[0]['status'] == 'rejected'
+    db.session.expire_all()
+    assert Bazar.query.count() == bazar_rows
+
+
+def test_negative_amounts_only_when_allowed():
+    assert str(parse_amount('-33.10', allow_negative=True)) == '-33.10'
+    assert str(parse_amount(' 12.5 ')) == '12.50'
@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+
+from flask import template_rendered
+
+from conftest import login
+from ledger import compute_balances, month_summary, user_balances
+from models import DEFAULT_MESS_ID
+
+
+@contextmanager
+def captured_context(app):
+    contexts = []
+
+    def record(sender, template, context, **extra):
+        contexts.append(context)
+
+    template_rendered.connect(record, app)
+    try:
+        yield contexts
+    finally:
+        template_rendered.disconnect(record, app)
+
+
+def render(app, username, path):
+    with captured_context(app) as contexts:
+        assert login(app, username).get(path).status_code == 200
+    return contexts[-1]
+
+
+# boarder_dashboard reads only its own user's totals; what it shows must
+# still be that user's row of the manager's compute_balances table
+def test_boarder_dashboard_matches_manager_balances(app, month_id):
+    users = user_balances(month_id, DEFAULT_MESS_ID)
+    summary = month_summary(month_id)
+    costs, balances = compute_balances(summary.total_bazar, [u.total_meal for u in users],
+                                       [u.deposit for u in users])
+    expected = {u.username: (u.total_meal, u.deposit, cost, balance)
+                for u, cost, balance in zip(users, costs, balances)}
+
+    manager = render(app, 'user0', '/manager/dashboard')
+    assert [(s['total_meal'], s['deposit'], s['meal_cost'], s['balance']) for s in manager['stats']] \
+        == list(expected.values())
+
+    boarders = [u.username for u in users if u.role == 'boarder']
+    assert boarders
+    for username in boarders:
+        page = render(app, username, '/boarder/dashboard')
+        assert (page['total_meal_count'], page['total_deposit'], page['meal_cost'], page['balance']) \
+            == expected[username], username
+        assert (page['total_bazar'], page['total_meals']) == (summary.total_bazar, summary.total_meals)
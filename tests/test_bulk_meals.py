@@ -0,0 +1,56 @@
+import pytest
+
+from conftest import login
+from ledger import month_summary
+from models import db, DEFAULT_MESS_ID, Meal, User, UserMonthBalance
+
+
+def balances(month_id, user_ids):
+    db.session.expire_all()
+    return {b.user_id: b.total_meal for b in UserMonthBalance.query
+            .filter(UserMonthBalance.month_id == month_id, UserMonthBalance.user_id.in_(user_ids))}
+
+
+# One JSON post changes a stored row and adds a new one; the balances and
+# the month's total move by the difference
+def test_json_upsert_updates_balances(app, month_id):
+    meal = Meal.query.filter_by(month_id=month_id).order_by(Meal.id).first()
+    day, changed = meal.date, meal.user_id
+    had_meal = {user_id for (user_id,) in db.session.query(Meal.user_id).filter_by(month_id=month_id, date=day)}
+    added = db.session.query(User.id).filter(User.mess_id == DEFAULT_MESS_ID, User.id.notin_(had_meal)) \
+        .order_by(User.id).limit(1).scalar()
+    old = meal.morning + meal.lunch + meal.dinner
+    before = balances(month_id, [changed, added])
+    total_before = month_summary(month_id).total_meals
+
+    response = login(app, 'user0').post('/manager/add_meals', json={'date': day.isoformat(), 'meals': [
+        {'user_id': changed, 'morning': 2, 'lunch': 2, 'dinner': 2},
+        {'user_id': added, 'morning': 1, 'lunch': 0, 'dinner': 1},
+    ]})
+    assert response.status_code == 200
+    assert response.get_json() == {'date': day.isoformat(), 'inserted': 1, 'updated': 1}
+
+    after = balances(month_id, [changed, added])
+    assert after[changed] == before[changed] + 6 - old
+    assert after[added] == before.get(added, 0) + 2
+    assert month_summary(month_id).total_meals == total_before + 6 - old + 2
+    assert Meal.query.filter_by(month_id=month_id, date=day, user_id=added).one().dinner == 1
+
+
+@pytest.mark.parametrize('payload', [
+    {'meals': [{'user_id': 2, 'morning': 1}]},
+    {'date': 'yesterday', 'meals': [{'user_id': 2, 'morning': 1}]},
+    {'date': '2030-01-01', 'meals': [{'user_id': 2, 'morning': -1}]},
+    {'date': '2030-01-01', 'meals': [{'user_id': 2, 'morning': 'two'}]},
+    {'date': '2030-01-01', 'meals': [{'morning': 1}]},
+    {'date': '2030-01-01', 'meals': [{'user_id': 2, 'morning': 1}, {'user_id': 999999, 'morning': 1}]},
+    {'date': '2030-01-01', 'meals': 5},
+])
+def test_bad_rows_are_refused(app, month_id, payload):
+    meals = Meal.query.count()
+    total = month_summary(month_id).total_meals
+    response = login(app, 'user0').post('/manager/add_meals', json=payload)
+    assert response.status_code == 400
+    db.session.expire_all()
+    assert Meal.query.count() == meals
+    assert month_summary(month_id).total_meals == total
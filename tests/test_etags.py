@@ -0,0 +1,28 @@
+import pytest
+
+from conftest import login
+from models import User
+
+
+# A poll with the current ETag gets a 304; a ledger write changes the tag
+@pytest.mark.parametrize('url', ['/api/summary', '/api/balances'])
+def test_etag_follows_ledger_writes(app, month_id, url):
+    client = login(app, 'user0')
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    cached = client.get(url, headers={'If-None-Match': etag})
+    assert cached.status_code == 304 and cached.data == b''
+    assert cached.headers['ETag'] == etag
+
+    compressed = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert client.get(url, headers={'If-None-Match': compressed.headers['ETag']}).status_code == 304
+
+    # credited to the caller, so /api/summary's own balance changes too
+    manager = User.query.filter_by(username='user0').one()
+    client.post('/manager/add_deposit', data={'date': '2030-01-01', 'user': manager.id, 'amount': '25'})
+    fresh = client.get(url, headers={'If-None-Match': etag})
+    assert fresh.status_code == 200
+    assert fresh.headers['ETag'] != etag
+    assert fresh.get_json() != first.get_json()
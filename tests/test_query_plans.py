@@ -0,0 +1,54 @@
+import pytest
+
+from ledger import roster_query
+from models import db, DEFAULT_MESS_ID, Month, Meal, Deposit, Bazar, UserMonthBalance, DailyRollup
+
+
+def explain(query):
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    if db.engine.dialect.name == 'sqlite':
+        return [r[-1] for r in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql))]
+    return [r[0] for r in db.session.execute(db.text('EXPLAIN ' + sql))]
+
+
+# The mess- and month-scoped lookups behind the dashboards, the view_*
+# listings and /api/analytics, each with the composite index it must be
+# answered from rather than a full table scan (and without sorting the
+# rows afterwards)
+QUERIES = {
+    'meal list': (lambda month_id: Meal.query.filter(Meal.month_id == month_id)
+                  .order_by(Meal.date, Meal.id), 'ix_meal_month_date'),
+    'meals by user': (lambda month_id: db.session.query(
+        Meal.user_id, db.func.sum(Meal.morning + Meal.lunch + Meal.dinner))
+        .filter(Meal.month_id == month_id).group_by(Meal.user_id), 'ix_meal_month_user'),
+    'deposit list': (lambda month_id: Deposit.query.filter(Deposit.month_id == month_id)
+                     .order_by(Deposit.date, Deposit.id), 'ix_deposit_month_date'),
+    'deposits by user': (lambda month_id: db.session.query(Deposit.boarder_id, db.func.sum(Deposit.amount))
+                         .filter(Deposit.month_id == month_id).group_by(Deposit.boarder_id),
+                         'ix_deposit_month_user'),
+    'bazar list': (lambda month_id: Bazar.query.filter(Bazar.month_id == month_id)
+                   .order_by(Bazar.date, Bazar.id), 'ix_bazar_month_date'),
+    'analytics days': (lambda month_id: db.session.query(DailyRollup.day, db.func.sum(DailyRollup.meals))
+                       .filter(DailyRollup.mess_id == DEFAULT_MESS_ID).group_by(DailyRollup.day)
+                       .order_by(DailyRollup.day), 'ix_daily_rollup_mess_day'),
+    'dashboard balances': (lambda month_id: db.session.query(
+        UserMonthBalance.user_id, UserMonthBalance.total_meal, UserMonthBalance.deposit)
+        .filter_by(month_id=month_id), 'user_month_balance'),
+    'roster': (lambda month_id: roster_query(DEFAULT_MESS_ID), 'ix_user_mess_id'),
+    'active month': (lambda month_id: Month.query.filter_by(mess_id=DEFAULT_MESS_ID, is_active=True)
+                     .order_by(Month.id.desc()), 'ix_month_mess_active'),
+}
+
+
+@pytest.fixture(scope='module', autouse=True)
+def analyze(app):
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('ANALYZE'))
+
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_query_uses_index(month_id, name):
+    build, index = QUERIES[name]
+    plan = explain(build(month_id))
+    assert any(index in line and 'INDEX' in line.upper() for line in plan), plan
+    assert not any('TEMP B-TREE' in line or 'Sort' in line for line in plan), plan
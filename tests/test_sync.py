@@ -0,0 +1,40 @@
+from conftest import login
+from models import DEFAULT_MESS_ID
+from sync import sync_entries
+
+
+def post(client, entries):
+    response = client.post('/api/sync', json={'entries': entries})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return [(r['client_id'], r['status']) for r in response.get_json()['results']]
+
+
+# A rejected entry must not take the rest of its batch down with it, and
+# what was saved is a duplicate when the batch is sent again
+def test_bad_meal_does_not_block_good_bazar(app):
+    client = login(app, 'user0')
+    entries = [
+        {'client_id': 'sync-bad-meal', 'kind': 'meals', 'date': '2030-01-01', 'user': 'nobody',
+         'morning': 1, 'lunch': 0, 'dinner': 0},
+        {'client_id': 'sync-good-bazar', 'kind': 'bazar', 'date': '2030-01-01', 'description': 'Rice',
+         'cost': '12.50'},
+    ]
+    assert post(client, entries) == [('sync-bad-meal', 'rejected'), ('sync-good-bazar', 'saved')]
+    assert post(client, entries) == [('sync-bad-meal', 'rejected'), ('sync-good-bazar', 'duplicate')]
+
+
+def test_unhashable_kind_is_rejected(app):
+    client = login(app, 'user0')
+    assert post(client, [{'client_id': 'sync-list-kind', 'kind': ['meals']}]) \
+        == [('sync-list-kind', 'rejected')]
+
+
+# With no active month, entries that name no month wait instead of failing
+def test_entries_wait_without_active_month(app, month_id):
+    entries = [{'client_id': 'sync-no-month', 'kind': 'bazar', 'date': '2030-01-01', 'description': 'Oil',
+                'cost': '3.00'},
+               {'client_id': 'sync-with-month', 'kind': 'bazar', 'date': '2030-01-01', 'description': 'Oil',
+                'cost': '3.00', 'month': month_id}]
+    results = sync_entries(entries, None, DEFAULT_MESS_ID, default_month_id=None)
+    assert [r['status'] for r in results] == ['waiting', 'saved']
+    assert sync_entries(entries[:1], None, DEFAULT_MESS_ID, default_month_id=month_id)[0]['status'] == 'saved'
@@ -0,0 +1,91 @@
+import io
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from auth import hash_password
+from conftest import login
+from ledger import rebuild_month_summary
+from models import db, Bazar, Deposit, Meal, Month, User
+from tenancy import create_mess
+
+
+# A second mess with a boarder, an active month and one entry of each kind
+@pytest.fixture(scope='module')
+def other(app):
+    mess = create_mess('North Hall', 'north1', hash_password('bench'))
+    boarder = User(mess_id=mess.id, name='North Boarder', username='north2', password=hash_password('bench'),
+                   role='boarder', first_login=False)
+    month = Month(mess_id=mess.id, name='North Month', is_active=True)
+    db.session.add_all([boarder, month])
+    db.session.flush()
+    day = date(2030, 1, 1)
+    meal = Meal(date=day, month_id=month.id, user_id=boarder.id, morning=1, lunch=1, dinner=0)
+    deposit = Deposit(date=day, month_id=month.id, boarder_id=boarder.id, amount=Decimal('500.00'))
+    bazar = Bazar(date=day, month_id=month.id, description='North rice', cost=Decimal('80.00'))
+    db.session.add_all([meal, deposit, bazar])
+    db.session.flush()
+    rebuild_month_summary(month.id)
+    db.session.commit()
+    return dict(user=boarder.id, month=month.id, meal=meal.id, deposit=deposit.id, bazar=bazar.id)
+
+
+# A manager of the seeded mess cannot reach the other mess's rows by id
+@pytest.mark.parametrize('method, url', [
+    ('get', '/users/edit/{user}'),
+    ('post', '/users/delete/{user}'),
+    ('get', '/manager/change_role/{user}'),
+    ('get', '/manager/disable_month/{month}'),
+    ('get', '/manager/delete_month/{month}'),
+    ('get', '/manager/months/{month}/report'),
+    ('get', '/api/months/{month}/balances'),
+    ('get', '/manager/delete_meal/{meal}'),
+    ('get', '/manager/delete_deposit/{deposit}'),
+    ('get', '/manager/delete_bazar/{bazar}'),
+])
+def test_other_mess_ids_are_not_found(app, other, method, url):
+    client = login(app, 'user0')
+    assert getattr(client, method)(url.format(**other)).status_code == 404
+    assert db.session.get(User, other['user']) is not None
+    month = db.session.get(Month, other['month'])
+    assert month is not None and month.is_active
+    for model in (Meal, Deposit, Bazar):
+        assert db.session.get(model, other[model.__name__.lower()]) is not None
+
+
+def test_other_mess_user_cannot_be_credited(app, other, month_id):
+    client = login(app, 'user0')
+    response = client.post('/manager/add_deposit', data={'date': '2030-01-01', 'user': other['user'],
+                                                         'amount': '10'})
+    assert response.status_code == 400
+    assert Deposit.query.filter_by(boarder_id=other['user'], month_id=month_id).count() == 0
+
+
+def test_sync_and_import_reject_other_mess_users(app, other, month_id):
+    client = login(app, 'user0')
+    entries = [{'client_id': 'tenancy-by-name', 'kind': 'deposits', 'date': '2030-01-01', 'user': 'north2',
+                'amount': '10'},
+               {'client_id': 'tenancy-by-id', 'kind': 'meals', 'date': '2030-01-01', 'user': other['user'],
+                'morning': 1, 'lunch': 0, 'dinner': 0},
+               {'client_id': 'tenancy-by-month', 'kind': 'bazar', 'date': '2030-01-01', 'description': 'Salt',
+                'cost': '1', 'month': other['month']}]
+    results = client.post('/api/sync', json={'entries': entries}).get_json()['results']
+    assert [r['status'] for r in results] == ['rejected'] * 3
+
+    csv = f"date,user,amount\n2030-01-01,north2,10\n2030-01-01,{other['user']},10\n"
+    upload = (io.BytesIO(csv.encode()), 'deposits.csv')
+    response = client.post('/manager/import', data={'kind': 'deposits', 'file': upload},
+                           content_type='multipart/form-data')
+    assert 'Imported 0 deposits row(s), 2 rejected' in response.get_data(as_text=True)
+    assert Deposit.query.filter_by(boarder_id=other['user']).count() == 1
+
+
+@pytest.mark.parametrize('url', ['/manager/dashboard', '/users', '/manager/add_deposit',
+                                 '/api/balances'])
+def test_other_mess_is_not_listed(app, other, url):
+    response = login(app, 'user0').get(url)
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    for name in ('North Boarder', 'north1', 'north2'):
+        assert name not in page
@@ -0,0 +1,220 @@
+import csv
+import io
+import json
+import time
+from datetime import date
+from decimal import Decimal
+
+from models import db, User, Month, Meal, Deposit, Bazar
+from ledger import update_ledger_batch, month_summary, user_balances, parse_amount, compute_balances
+
+
+# ---------------- IMPORT ----------------
+# Required CSV columns per kind. Every kind also accepts an optional "month"
+# column (month name or id); rows without one go to the default month.
+# "user" may be a username or a user id.
+IMPORT_COLUMNS = {
+    'meals': ('date', 'user', 'morning', 'lunch', 'dinner'),
+    'deposits': ('date', 'user', 'amount'),
+    'bazar': ('date', 'description', 'cost'),
+}
+IMPORT_MODELS = {'meals': Meal, 'deposits': Deposit, 'bazar': Bazar}
+MAX_REPORTED_REJECTS = 1000
+
+
+def parse_import_row(kind, row, users, months, default_month_id):
+    try:
+        day = date.fromisoformat((row['date'] or '').strip())
+    except ValueError:
+        raise ValueError(f"bad date {row['date']!r}")
+    month_name = (row.get('month') or '').strip()
+    month_id = months.get(month_name) if month_name else default_month_id
+    if month_id is None:
+        raise ValueError(f"unknown month {month_name!r}" if month_name else "no month given")
+
+    if kind == 'bazar':
+        cost = parse_amount(row['cost'])
+        return {'date': day, 'month_id': month_id,
+                'description': (row['description'] or '').strip()[:100], 'cost': cost}
+
+    user_id = users.get((row['user'] or '').strip())
+    if user_id is None:
+        raise ValueError(f"unknown user {row['user']!r}")
+    if kind == 'deposits':
+        amount = parse_amount(row['amount'])
+        return {'date': day, 'month_id': month_id, 'boarder_id': user_id, 'amount': amount}
+
+    counts = [int(row[k] or 0) for k in ('morning', 'lunch', 'dinner')]
+    if any(n < 0 for n in counts):
+        raise ValueError("negative meal count")
+    return {'date': day, 'month_id': month_id, 'user_id': user_id,
+            'morning': counts[0], 'lunch': counts[1], 'dinner': counts[2]}
+
+
+# Insert one batch of (line, record) pairs and its ledger changes; the
+# caller commits. Meals that already exist for the same user/date/month (in
+# the database or earlier in the batch) are rejected rather than
+# duplicated. Returns the lines of the accepted records.
+def import_batch(kind, batch, reject):
+    if not batch:
+        return []
+    if kind == 'meals':
+        keys = {(r['user_id'], r['date'], r['month_id']) for _, r in batch}
+        existing = set(db.session.query(Meal.user_id, Meal.date, Meal.month_id).filter(
+            Meal.user_id.in_({k[0] for k in keys}),
+            Meal.month_id.in_({k[2] for k in keys}),
+            Meal.date.between(min(k[1] for k in keys), max(k[1] for k in keys))))
+        accepted = []
+        for line, record in batch:
+            key = (record['user_id'], record['date'], record['month_id'])
+            if key in existing:
+                reject(line, "meal already recorded for this user and date")
+            else:
+                existing.add(key)
+                accepted.append((line, record))
+    else:
+        accepted = batch
+
+    db.session.bulk_insert_mappings(IMPORT_MODELS[kind], [record for _, record in accepted])
+
+    changes = {}
+    for _, r in accepted:
+        meals, deposits, bazar, days = changes.setdefault(r['month_id'], ({}, {}, [0], {}))
+        day_meals, day_bazar = days.get(r['date'], (0, 0))
+        if kind == 'meals':
+            count = r['morning'] + r['lunch'] + r['dinner']
+            meals[r['user_id']] = meals.get(r['user_id'], 0) + count
+            days[r['date']] = (day_meals + count, day_bazar)
+        elif kind == 'deposits':
+            deposits[r['boarder_id']] = deposits.get(r['boarder_id'], 0) + r['amount']
+        else:
+            bazar[0] += r['cost']
+            days[r['date']] = (day_meals, day_bazar + r['cost'])
+    for month_id, (meals, deposits, bazar, days) in changes.items():
+        update_ledger_batch(month_id, meals=meals, deposits=deposits, bazar=bazar[0], days=days)
+    return [line for line, _ in accepted]
+
+
+# Stream rows from a CSV text stream into a mess's months in batches of
+# batch_size, one transaction per batch, so memory use does not grow with
+# the file. Users and months are matched within the mess only. Raises
+# ValueError if required columns are missing.
+def import_csv(kind, stream, mess_id, default_month_id=None, batch_size=1000):
+    reader = csv.DictReader(stream)
+    missing = [c for c in IMPORT_COLUMNS[kind] if c not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError(f"missing column(s): {', '.join(missing)}")
+
+    users = {}
+    for user_id, username in db.session.query(User.id, User.username).filter(User.mess_id == mess_id):
+        users[str(user_id)] = user_id
+        users[username] = user_id
+    months = {}
+    for month_id, name in db.session.query(Month.id, Month.name).filter(Month.mess_id == mess_id):
+        months[str(month_id)] = month_id
+        months[name] = month_id
+
+    result = {'imported': 0, 'rejected': [], 'rejected_count': 0}
+
+    def reject(line, reason):
+        result['rejected_count'] += 1
+        if len(result['rejected']) < MAX_REPORTED_REJECTS:
+            result['rejected'].append((line, reason))
+
+    started = time.perf_counter()
+    batch = []
+    for row in reader:
+        try:
+            batch.append((reader.line_num, parse_import_row(kind, row, users, months, default_month_id)))
+        except (KeyError, TypeError, ValueError) as e:
+            reject(reader.line_num, str(e))
+            continue
+        if len(batch) >= batch_size:
+            result['imported'] += len(import_batch(kind, batch, reject))
+            db.session.commit()
+            batch = []
+    if batch:
+        result['imported'] += len(import_batch(kind, batch, reject))
+        db.session.commit()
+
+    result['rejected'].sort()
+    result['seconds'] = time.perf_counter() - started
+    result['rows_per_second'] = result['imported'] / result['seconds'] if result['seconds'] else 0
+    return result
+
+
+# ---------------- EXPORT ----------------
+# Columns match IMPORT_COLUMNS (plus "month") so an export can be re-imported.
+EXPORT_COLUMNS = {
+    'meals': ('month', 'date', 'user', 'morning', 'lunch', 'dinner'),
+    'deposits': ('month', 'date', 'user', 'amount'),
+    'bazar': ('month', 'date', 'description', 'cost'),
+    'balances': ('month', 'user', 'name', 'role', 'total_meal', 'deposit', 'meal_cost', 'balance'),
+}
+EXPORT_BATCH = 1000
+
+
+# Yield one dict per exported row for one of a mess's months (or all of
+# them when month_id is None). Raw rows are fetched EXPORT_BATCH at a time with
+# yield_per, which uses a server-side cursor on PostgreSQL.
+def export_rows(kind, mess_id, month_id=None):
+    if kind == 'balances':
+        months = Month.query.filter_by(mess_id=mess_id).order_by(Month.id)
+        if month_id is not None:
+            months = months.filter(Month.id == month_id)
+        for month in months.all():
+            summary = month_summary(month.id)
+            users = user_balances(month.id, mess_id)
+            costs, balances = compute_balances(summary.total_bazar, [u.total_meal for u in users],
+                                               [u.deposit for u in users])
+            for u, meal_cost, balance in zip(users, costs, balances):
+                yield {'month': month.name, 'user': u.username, 'name': u.name, 'role': u.role,
+                       'total_meal': u.total_meal, 'deposit': u.deposit,
+                       'meal_cost': meal_cost, 'balance': balance}
+        return
+
+    if kind == 'meals':
+        model = Meal
+        query = db.session.query(Month.name.label('month'), Meal.date, User.username.label('user'),
+                                 Meal.morning, Meal.lunch, Meal.dinner) \
+            .select_from(Meal).outerjoin(User, Meal.user_id == User.id)
+    elif kind == 'deposits':
+        model = Deposit
+        query = db.session.query(Month.name.label('month'), Deposit.date, User.username.label('user'),
+                                 Deposit.amount) \
+            .select_from(Deposit).outerjoin(User, Deposit.boarder_id == User.id)
+    else:
+        model = Bazar
+        query = db.session.query(Month.name.label('month'), Bazar.date, Bazar.description, Bazar.cost) \
+            .select_from(Bazar)
+
+    query = query.join(Month, model.month_id == Month.id).filter(Month.mess_id == mess_id)
+    if month_id is not None:
+        query = query.filter(model.month_id == month_id)
+    for row in query.order_by(model.month_id, model.date, model.id).yield_per(EXPORT_BATCH):
+        yield row._asdict()
+
+
+def export_csv(kind, rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS[kind])
+    writer.writeheader()
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Amounts go out as numbers, dates as ISO strings
+def _json_default(value):
+    return float(value) if isinstance(value, Decimal) else str(value)
+
+
+def export_json(rows):
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',\n' if i else '\n') + json.dumps(row, default=_json_default)
+    yield '\n]\n'
@@ -0,0 +1,997 @@
+from flask import (Blueprint, current_app, render_template, redirect, url_for, request, flash,
+                   jsonify, abort, Response, stream_with_context)
+from flask_login import login_user, logout_user, login_required, current_user
+from datetime import date, datetime, timezone
+from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
+import hmac
+import io
+
+from models import (db, User, Month, Meal, Deposit, Bazar, MonthSummary, UserMonthBalance, MonthClose,
+                    MonthCloseBalance, DailyRollup, LedgerEvent, LedgerCheckpoint, LedgerCheckpointBalance)
+from ledger import (get_active_month, invalidate_active_month, get_roster, invalidate_roster,
+                    month_summary, user_balances, update_ledger, save_day_meals, parse_amount,
+                    meal_rate, compute_balances, user_meal_cost, ZERO)
+from closing import queue_month_close, run_month_closes
+from events import record_event, ledger_at, utcnow
+from auth import hash_password, authenticate, remember_user, forget_user
+from sync import MAX_SYNC_ENTRIES, sync_entries
+from analytics import meals_per_day, bazar_per_week, user_consumption, user_months
+from transfer import IMPORT_COLUMNS, EXPORT_COLUMNS, import_csv, export_rows, export_csv, export_json
+
+bp = Blueprint('main', __name__)
+
+BOOTSTRAP_CSS = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css'
+
+
+@bp.app_context_processor
+def asset_urls():
+    return {'bootstrap_css': BOOTSTRAP_CSS}
+
+
+# ---------------- PAGINATION ----------------
+# ?per_page clamped to 1..MAX_PAGE_SIZE (PAGE_SIZE when missing or zero)
+def page_size():
+    per_page = request.args.get('per_page', type=int) or current_app.config['PAGE_SIZE']
+    return max(1, min(per_page, current_app.config['MAX_PAGE_SIZE']))
+
+
+# Keyset pagination over (date, id) for the month listings. The page after
+# a row is found by seeking past its (date, id) on the month indexes instead
+# of OFFSET, so deep pages cost the same as the first one. Reads the filter
+# and cursor query args and returns (rows, filters, next_args).
+def keyset_page(model, month_id, user_column=None, options=()):
+    filters = {
+        'user_id': request.args.get('user_id', type=int) if user_column is not None else None,
+        'start': request.args.get('start', type=date.fromisoformat),
+        'end': request.args.get('end', type=date.fromisoformat),
+    }
+    filters = {k: v for k, v in filters.items() if v}
+    per_page = page_size()
+    if request.args.get('per_page', type=int):
+        filters['per_page'] = per_page
+
+    query = model.query.options(*options).filter(model.month_id == month_id)
+    if 'user_id' in filters:
+        query = query.filter(user_column == filters['user_id'])
+    if 'start' in filters:
+        query = query.filter(model.date >= filters['start'])
+    if 'end' in filters:
+        query = query.filter(model.date <= filters['end'])
+
+    after_date = request.args.get('after_date', type=date.fromisoformat)
+    after_id = request.args.get('after_id', type=int)
+    if after_date and after_id:
+        query = query.filter(db.or_(model.date > after_date,
+                                    db.and_(model.date == after_date, model.id > after_id)))
+
+    rows = query.order_by(model.date, model.id).limit(per_page + 1).all()
+    next_args = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_args = dict(filters, after_date=rows[-1].date.isoformat(), after_id=rows[-1].id)
+    return rows, filters, next_args
+
+
+# ---------------- TENANCY ----------------
+# Users, months and entries are looked up within the logged-in user's mess,
+# so ids from another mess behave as if they did not exist.
+def mess_user_or_404(user_id):
+    return User.query.filter_by(id=user_id, mess_id=current_user.mess_id).first_or_404()
+
+
+def mess_month(month_id):
+    return Month.query.filter_by(id=month_id, mess_id=current_user.mess_id).first()
+
+
+def mess_entry(model, entry_id):
+    return model.query.join(Month, Month.id == model.month_id) \
+        .filter(model.id == entry_id, Month.mess_id == current_user.mess_id).first()
+
+
+def record_role_change(user, role):
+    if role != user.role:
+        record_event('role', mess_id=user.mess_id, user_id=user.id, detail=f'{user.role} -> {role}')
+    user.role = role
+
+
+# ---------------- ROUTES ----------------
+
+# List all users
+@bp.route('/users')
+@login_required
+def user_list():
+    if current_user.role != 'manager':
+        flash("Access denied!", "danger")
+        return redirect(url_for('.dashboard'))
+    users = get_roster(current_user.mess_id).by_id.values()
+    return render_template('user_list.html', users=users)
+
+
+# Add new user
+@bp.route('/users/add', methods=['GET', 'POST'])
+@login_required
+def add_user():
+    if current_user.role != 'manager':
+        flash("Access denied!", "danger")
+        return redirect(url_for('.dashboard'))
+    
+    if request.method == 'POST':
+        name = request.form['name']
+        username = request.form['username']
+        password = hash_password(request.form['password'])
+        role = request.form['role']
+        
+        if User.query.filter_by(username=username).first():
+            flash("Username already exists!", "warning")
+            return redirect(url_for('.add_user'))
+        
+        new_user = User(mess_id=current_user.mess_id, name=name, username=username, password=password,
+                        role=role, first_login=True)
+        db.session.add(new_user)
+        db.session.flush()
+        record_event('user_added', mess_id=current_user.mess_id, user_id=new_user.id,
+                     detail=f'{username} ({role})')
+        invalidate_roster(current_user.mess_id)
+        db.session.commit()
+        flash("User added successfully!", "success")
+        return redirect(url_for('.user_list'))
+
+    return render_template('add_user.html')
+
+# Edit user role
+@bp.route('/users/edit/<int:user_id>', methods=['GET', 'POST'])
+@login_required
+def edit_user(user_id):
+    if current_user.role != 'manager':
+        flash("Access denied!", "danger")
+        return redirect(url_for('.dashboard'))
+    
+    user = mess_user_or_404(user_id)
+    
+    if request.method == 'POST':
+        record_role_change(user, request.form['role'])
+        invalidate_roster(current_user.mess_id)
+        db.session.commit()
+        flash("User role updated!", "success")
+        return redirect(url_for('.user_list'))
+    
+    return render_template('edit_user.html', user=user)
+
+# Delete user
+@bp.route('/users/delete/<int:user_id>', methods=['POST'])
+@login_required
+def delete_user(user_id):
+    if current_user.role != 'manager':
+        flash("Access denied!", "danger")
+        return redirect(url_for('.dashboard'))
+    
+    user = mess_user_or_404(user_id)
+    UserMonthBalance.query.filter_by(user_id=user.id).delete()
+    record_event('user_deleted', mess_id=user.mess_id, user_id=user.id, detail=user.username)
+    db.session.delete(user)
+    invalidate_roster(current_user.mess_id)
+    db.session.commit()
+    flash("User deleted successfully!", "success")
+    return redirect(url_for('.user_list'))
+
+
+@bp.route('/')
+def index():
+    if current_user.is_authenticated:
+        if current_user.role == 'manager':
+            return redirect(url_for('.manager_dashboard'))
+        else:
+            return redirect(url_for('.boarder_dashboard'))
+    return redirect(url_for('.login'))
+
+
+
+
+@bp.route('/change_password', methods=['GET', 'POST'])
+@login_required
+def change_password():
+    if request.method == 'POST':
+        new_password = request.form['new_password']
+        user = db.session.get(User, current_user.id)
+        user.password = hash_password(new_password)
+        user.first_login = False
+        db.session.commit()
+        flash("Password updated successfully!")
+        return redirect(url_for('.index'))
+
+    return render_template('change_password.html')
+
+
+
+@bp.route('/manager/change_role/<int:user_id>', methods=['GET', 'POST'])
+@login_required
+def change_role(user_id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+
+    user = mess_user_or_404(user_id)
+
+    if request.method == 'POST':
+        record_role_change(user, request.form['role'])
+        invalidate_roster(current_user.mess_id)
+        db.session.commit()
+        flash(f"Role of {user.name} updated to {user.role}")
+        return redirect(url_for('.list_users'))
+
+    return render_template('change_role.html', user=user)
+
+@bp.route('/manager/list_users')
+@login_required
+def list_users():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+
+    users = get_roster(current_user.mess_id).by_id.values()
+    return render_template('list_users.html', users=users)
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+
+        user = authenticate(username, password)
+
+        if user:
+            db.session.commit()
+            login_user(user)
+            remember_user(user)
+            if user.first_login:
+                return redirect(url_for('.change_password'))
+            return redirect(url_for('.index'))
+        else:
+            flash("Invalid credentials!", "danger")
+            return redirect(url_for('.login'))
+
+    return render_template('login.html')
+
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    forget_user()
+    return redirect(url_for('.login'))
+
+
+# ---------------- MONTH MANAGEMENT ----------------
+
+@bp.route('/manager/months', methods=['GET', 'POST'])
+@login_required
+def manage_months():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+
+    if request.method == 'POST':
+        name = request.form['name']
+        # disable the mess's active months and freeze them in the background
+        ended = [month_id for (month_id,) in
+                 db.session.query(Month.id).filter_by(mess_id=current_user.mess_id, is_active=True)]
+        Month.query.filter_by(mess_id=current_user.mess_id).update({Month.is_active: False})
+        queue_month_close(ended)
+        new_month = Month(mess_id=current_user.mess_id, name=name, is_active=True)
+        db.session.add(new_month)
+        db.session.flush()
+        # an empty summary up front, so the first entry is logged as itself
+        db.session.add(MonthSummary(month_id=new_month.id, total_bazar=0, total_meals=0))
+        for month_id in ended:
+            record_event('month_ended', month_id)
+        record_event('month_started', new_month.id, detail=name)
+        db.session.commit()
+        invalidate_active_month(current_user.mess_id)
+        run_month_closes(ended)
+        flash(f'Month "{name}" started and set active.')
+        return redirect(url_for('.manage_months'))
+
+    months = Month.query.filter_by(mess_id=current_user.mess_id).all()
+    closes = dict(db.session.query(MonthClose.month_id, MonthClose.status)
+                  .join(Month, Month.id == MonthClose.month_id).filter(Month.mess_id == current_user.mess_id))
+    return render_template('manage_months.html', months=months, closes=closes)
+
+
+@bp.route('/manager/disable_month/<int:id>')
+@login_required
+def disable_month(id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    month = mess_month(id) or abort(404)
+    ended = [month.id] if month.is_active else []
+    month.is_active = False
+    queue_month_close(ended)
+    for month_id in ended:
+        record_event('month_ended', month_id)
+    db.session.commit()
+    invalidate_active_month(current_user.mess_id)
+    run_month_closes(ended)
+    flash(f'Month "{month.name}" disabled.')
+    return redirect(url_for('.manage_months'))
+
+
+@bp.route('/manager/delete_month/<int:id>')
+@login_required
+def delete_month(id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    month = mess_month(id) or abort(404)
+    UserMonthBalance.query.filter_by(month_id=month.id).delete()
+    MonthSummary.query.filter_by(month_id=month.id).delete()
+    MonthCloseBalance.query.filter_by(month_id=month.id).delete()
+    MonthClose.query.filter_by(month_id=month.id).delete()
+    DailyRollup.query.filter_by(month_id=month.id).delete()
+    LedgerCheckpointBalance.query.filter_by(month_id=month.id).delete()
+    LedgerCheckpoint.query.filter_by(month_id=month.id).delete()
+    record_event('month_deleted', month.id, mess_id=month.mess_id, detail=month.name)
+    db.session.delete(month)
+    db.session.commit()
+    invalidate_active_month(current_user.mess_id)
+    flash(f'Month "{month.name}" deleted.')
+    return redirect(url_for('.manage_months'))
+
+
+# Frozen report of a closed month: two reads on the snapshot tables,
+# however many entries the month had
+@bp.route('/manager/months/<int:id>/report')
+@login_required
+def month_report(id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    month = mess_month(id) or abort(404)
+    close = db.session.get(MonthClose, month.id)
+    if close is None or close.status != 'done':
+        flash(f'Month "{month.name}" has no closing report yet'
+              + (f' ({close.status}).' if close else '.'), 'warning')
+        return redirect(url_for('.manage_months'))
+
+    balances = MonthCloseBalance.query.filter_by(month_id=month.id).order_by(MonthCloseBalance.user_id).all()
+    summary = db.session.get(MonthSummary, month.id)
+    changed = summary is not None and summary.version != close.ledger_version
+    return render_template('month_report.html', month=month, close=close,
+                           balances=balances, changed=changed)
+
+
+# ---------------- DASHBOARDS ----------------
+
+@bp.route('/manager/dashboard')
+@login_required
+def manager_dashboard():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found.")
+        return redirect(url_for('.manage_months'))
+
+    summary = month_summary(active_month.id)
+    total_bazar, total_meals = summary.total_bazar, summary.total_meals
+
+    # Meal rate
+    rate = meal_rate(total_bazar, total_meals)
+
+    # Include all users (boarders + managers)
+    users = user_balances(active_month.id, current_user.mess_id)
+    costs, balances = compute_balances(total_bazar, [u.total_meal for u in users],
+                                       [u.deposit for u in users])
+    stats = []
+    for u, meal_cost, balance in zip(users, costs, balances):
+        stats.append({
+            'name': u.name,
+            'role': u.role,
+            'total_meal': u.total_meal,
+            'deposit': u.deposit,
+            'meal_cost': meal_cost,
+            'balance': balance
+        })
+
+    return render_template('manager_dashboard.html',
+                           active_month=active_month,
+                           total_bazar=total_bazar,
+                           total_meals=total_meals,
+                           meal_rate=rate,
+                           stats=stats)
+
+
+@bp.route('/boarder/dashboard')
+@login_required
+def boarder_dashboard():
+    if current_user.role != 'boarder':
+        return redirect(url_for('.index'))
+
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        # index would send a boarder straight back here, so render instead
+        flash("No active month found.")
+        return render_template('boarder_dashboard.html', active_month=None)
+
+    # two primary-key lookups plus one summed range of the month's balance
+    # index; no raw meal rows are read
+    summary = month_summary(active_month.id)
+    total_bazar, total_meals = summary.total_bazar, summary.total_meals
+
+    mine = db.session.get(UserMonthBalance, (active_month.id, current_user.id))
+    total_meal_count = mine.total_meal if mine else 0
+    total_deposit = mine.deposit if mine else ZERO
+    meal_cost = user_meal_cost(active_month.id, current_user.id, total_bazar, total_meals,
+                               total_meal_count)
+    balance = total_deposit - meal_cost
+
+    return render_template('boarder_dashboard.html',
+                           active_month=active_month,
+                           total_bazar=total_bazar,
+                           total_meals=total_meals,
+                           meal_rate=meal_rate(total_bazar, total_meals),
+                           total_meal_count=total_meal_count,
+                           total_deposit=total_deposit,
+                           meal_cost=meal_cost,
+                           balance=balance)
+
+
+# ---------------- API ----------------
+# Read-only JSON for the dashboards. ETags come from the month's ledger
+# version, so a poll with a matching If-None-Match gets a 304 after one
+# primary-key lookup on month_summary. Responses are per user: browsers may
+# keep them but must revalidate, and shared caches must not store them.
+def conditional_json(etag, build):
+    # weak comparison, as If-None-Match calls for: compressed responses
+    # carry the same tag marked weak
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+# Amounts are exact Decimals internally; JSON clients get plain numbers
+def summary_payload(active_month, summary):
+    return {
+        'month': {'id': active_month.id, 'name': active_month.name},
+        'total_bazar': float(summary.total_bazar),
+        'total_meals': summary.total_meals,
+        'meal_rate': float(meal_rate(summary.total_bazar, summary.total_meals)),
+    }
+
+
+def balance_payload(total_meal, deposit, meal_cost):
+    return {'total_meal': total_meal, 'deposit': float(deposit),
+            'meal_cost': float(meal_cost), 'balance': float(deposit - meal_cost)}
+
+
+# Month totals plus the logged-in user's own balance
+@bp.route('/api/summary')
+@login_required
+def api_summary():
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        return jsonify(error="No active month found."), 404
+    summary = month_summary(active_month.id)
+
+    def build():
+        payload = summary_payload(active_month, summary)
+        mine = db.session.get(UserMonthBalance, (active_month.id, current_user.id))
+        total_meal = mine.total_meal if mine else 0
+        meal_cost = user_meal_cost(active_month.id, current_user.id, summary.total_bazar,
+                                   summary.total_meals, total_meal)
+        payload['me'] = balance_payload(total_meal, mine.deposit if mine else ZERO, meal_cost)
+        return payload
+
+    return conditional_json(f'{active_month.id}-{summary.version}-{current_user.id}', build)
+
+
+# Every user's balance for the active month (managers only). The ETag also
+# carries the roster version, so adding, renaming or removing users
+# changes it.
+@bp.route('/api/balances')
+@login_required
+def api_balances():
+    if current_user.role != 'manager':
+        return jsonify(error="Access denied!"), 403
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        return jsonify(error="No active month found."), 404
+    summary = month_summary(active_month.id)
+    roster = get_roster(current_user.mess_id)
+
+    def build():
+        payload = summary_payload(active_month, summary)
+        users = user_balances(active_month.id, current_user.mess_id)
+        costs, _ = compute_balances(summary.total_bazar, [u.total_meal for u in users],
+                                    [u.deposit for u in users])
+        payload['users'] = [
+            dict(id=u.id, name=u.name, role=u.role, **balance_payload(u.total_meal, u.deposit, meal_cost))
+            for u, meal_cost in zip(users, costs)
+        ]
+        return payload
+
+    return conditional_json(f'{active_month.id}-{summary.version}-r{roster.version}', build)
+
+
+# Trends across months (managers only): meals per day, bazar per week and
+# each user's meals and deposits, between optional ?start= and ?end= dates.
+# ?user_id= swaps the per-user totals for that user's month-by-month
+# figures; ?series=meals,bazar,users picks which parts to build. Reads only
+# the rollup and per-month balance tables.
+ANALYTICS_SERIES = {'meals': meals_per_day, 'bazar': bazar_per_week}
+
+
+@bp.route('/api/analytics')
+@login_required
+def api_analytics():
+    if current_user.role != 'manager':
+        return jsonify(error="Access denied!"), 403
+    try:
+        start, end = (date.fromisoformat(request.args[k]) if request.args.get(k) else None
+                      for k in ('start', 'end'))
+    except ValueError:
+        return jsonify(error="Dates must be YYYY-MM-DD."), 400
+    series = request.args.get('series', 'meals,bazar,users').split(',')
+    unknown = set(series) - ANALYTICS_SERIES.keys() - {'users'}
+    if unknown:
+        return jsonify(error=f"Unknown series: {', '.join(sorted(unknown))}."), 400
+
+    payload = {'start': start.isoformat() if start else None, 'end': end.isoformat() if end else None}
+    for name, build in ANALYTICS_SERIES.items():
+        if name in series:
+            payload[name] = build(current_user.mess_id, start, end)
+    user_id = request.args.get('user_id', type=int)
+    if 'users' in series and user_id is not None:
+        payload['user'] = user_months(current_user.mess_id, user_id, start, end)
+    elif 'users' in series:
+        payload['users'] = user_consumption(current_user.mess_id, start, end)
+    return jsonify(payload)
+
+
+# A month's balances as they stood at ?at= (an ISO date-time, UTC unless it
+# carries an offset; default now), rebuilt from the month's nearest ledger
+# checkpoint plus the events after it (managers only).
+@bp.route('/api/months/<int:id>/balances')
+@login_required
+def api_month_balances(id):
+    if current_user.role != 'manager':
+        return jsonify(error="Access denied!"), 403
+    month = mess_month(id)
+    if month is None:
+        return jsonify(error="No such month."), 404
+    try:
+        when = datetime.fromisoformat(request.args['at']) if request.args.get('at') else utcnow()
+    except ValueError:
+        return jsonify(error="at must be an ISO date-time, e.g. 2025-01-31T18:00:00."), 400
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+
+    state = ledger_at(month.id, when)
+    roster = get_roster(current_user.mess_id).by_id
+    user_ids = sorted(roster.keys() | state.users.keys())
+    totals = [state.users.get(user_id, (0, ZERO)) for user_id in user_ids]
+    costs, _ = compute_balances(state.total_bazar, [meals for meals, _ in totals],
+                                [deposit for _, deposit in totals])
+    payload = summary_payload(month, state)
+    payload.update(at=when.isoformat(), event_id=state.event_id)
+    payload['users'] = [
+        dict(id=user_id, name=roster[user_id].name if user_id in roster else None,
+             role=roster[user_id].role if user_id in roster else None,
+             **balance_payload(total_meal, deposit, meal_cost))
+        for user_id, (total_meal, deposit), meal_cost in zip(user_ids, totals, costs)
+    ]
+    return jsonify(payload)
+
+
+# The mess's ledger and audit events, newest first (managers only).
+# ?month_id= narrows to one month; pass ?before_id=<next_before_id> from
+# the previous page for the next one.
+@bp.route('/api/events')
+@login_required
+def api_events():
+    if current_user.role != 'manager':
+        return jsonify(error="Access denied!"), 403
+    per_page = page_size()
+    query = LedgerEvent.query.filter(LedgerEvent.mess_id == current_user.mess_id)
+    month_id = request.args.get('month_id', type=int)
+    if month_id:
+        query = query.filter(LedgerEvent.month_id == month_id)
+    kind = request.args.get('kind')
+    if kind:
+        query = query.filter(LedgerEvent.kind == kind)
+    before_id = request.args.get('before_id', type=int)
+    if before_id:
+        query = query.filter(LedgerEvent.id < before_id)
+    rows = query.order_by(LedgerEvent.id.desc()).limit(per_page + 1).all()
+    next_before_id = rows[per_page - 1].id if len(rows) > per_page else None
+    events = [{
+        'id': e.id, 'at': e.at.isoformat(), 'kind': e.kind, 'month_id': e.month_id,
+        'user_id': e.user_id, 'actor_id': e.actor_id, 'day': e.day.isoformat() if e.day else None,
+        'meals': e.meals or 0, 'deposit': float(e.deposit or 0), 'bazar': float(e.bazar or 0),
+        'detail': e.detail,
+    } for e in rows[:per_page]]
+    return jsonify(events=events, next_before_id=next_before_id)
+
+
+# ---------------- METRICS ----------------
+# HTML for managers; ?format=prometheus gives the text exposition format,
+# which a scraper can fetch with the METRICS_TOKEN bearer token.
+@bp.route('/manager/metrics')
+def metrics_page():
+    token = current_app.config['METRICS_TOKEN']
+    auth = request.headers.get('Authorization', '')
+    by_token = bool(token) and hmac.compare_digest(auth, f'Bearer {token}')
+    if not by_token:
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        if current_user.role != 'manager':
+            return redirect(url_for('.index'))
+
+    metrics = current_app.extensions['metrics']
+    if request.args.get('format') == 'prometheus' or by_token:
+        return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+    endpoints, warnings = metrics.snapshot()
+    return render_template('metrics.html', enabled=metrics.enabled, endpoints=endpoints,
+                           warnings=warnings, started=metrics.started)
+
+
+# ---------------- ADD MEAL ----------------
+@bp.route('/add_meal/', defaults={'month_id': None}, methods=['GET','POST'])
+@bp.route('/add_meal/<int:month_id>', methods=['GET','POST'])
+@login_required
+def add_meal(month_id):
+    if not month_id:
+        # pick the current active month
+        active_month = get_active_month(current_user.mess_id)
+        if not active_month:
+            flash("No active month found. Start a month first.")
+            return redirect(url_for('.manage_months'))
+        month_id = active_month.id
+    else:
+        active_month = mess_month(month_id) or abort(404)
+    roster = get_roster(current_user.mess_id)
+    users = roster.users
+
+    if request.method == 'POST':
+        date_str = request.form.get('date')
+        user_id = int(request.form.get('user_id'))
+        if user_id not in roster.by_id:
+            abort(400)
+        morning = int(request.form.get('morning', 0))
+        lunch = int(request.form.get('lunch', 0))
+        dinner = int(request.form.get('dinner', 0))
+
+        if Meal.query.filter_by(user_id=user_id, date=date.fromisoformat(date_str),
+                                month_id=active_month.id).first():
+            flash("Meal for this user and date already exists!", "warning")
+            return redirect(url_for('.add_meal', month_id=month_id))
+
+        meal = Meal(
+            date=date.fromisoformat(date_str),
+            user_id=user_id,
+            morning=morning,
+            lunch=lunch,
+            dinner=dinner,
+            month_id=active_month.id
+        )
+
+        db.session.add(meal)
+        update_ledger('meal', meal.month_id, user_id, meals=morning + lunch + dinner, day=meal.date)
+        db.session.commit()
+        flash("Meal added successfully!", "success")
+        return redirect(url_for('.add_meal', month_id=month_id))
+
+    return render_template('add_meal.html', active_month=active_month, users=users)
+
+# Accepts the grid form (morning-<id>, lunch-<id>, dinner-<id> per user) or
+# JSON: {"date": "2025-01-31", "meals": [{"user_id": 1, "morning": 1, ...}]}
+@bp.route('/manager/add_meals', methods=['GET', 'POST'])
+@login_required
+def add_meals_bulk():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found. Start a month first.")
+        return redirect(url_for('.manage_months'))
+    roster = get_roster(current_user.mess_id)
+    users = roster.users
+    user_ids = roster.by_id.keys()
+
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) if request.is_json else None
+        try:
+            if payload is not None:
+                day = date.fromisoformat(payload['date'])
+                entries = {int(row['user_id']): (int(row.get('morning', 0)), int(row.get('lunch', 0)),
+                                                 int(row.get('dinner', 0)))
+                           for row in payload['meals']}
+            else:
+                day = date.fromisoformat(request.form['date'])
+                entries = {u: (int(request.form.get(f'morning-{u}') or 0),
+                               int(request.form.get(f'lunch-{u}') or 0),
+                               int(request.form.get(f'dinner-{u}') or 0))
+                           for u in user_ids if f'morning-{u}' in request.form}
+        except (KeyError, TypeError, ValueError):
+            abort(400)
+        if not entries.keys() <= user_ids or any(n < 0 for counts in entries.values() for n in counts):
+            abort(400)
+
+        inserted, updated = save_day_meals(active_month.id, day, entries)
+        if payload is not None:
+            return jsonify(date=day.isoformat(), inserted=inserted, updated=updated)
+        flash(f"Meals for {day} saved ({inserted} added, {updated} updated).", "success")
+        return redirect(url_for('.add_meals_bulk', date=day.isoformat()))
+
+    day = request.args.get('date', type=date.fromisoformat) or date.today()
+    current = {m.user_id: m for m in Meal.query.filter_by(month_id=active_month.id, date=day)}
+    return render_template('add_meals_bulk.html', active_month=active_month, users=users,
+                           day=day, current=current)
+
+
+@bp.route('/manager/import', methods=['GET', 'POST'])
+@login_required
+def import_data():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    active_month = get_active_month(current_user.mess_id)
+    result = None
+
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in IMPORT_COLUMNS or not upload:
+            flash("Choose what to import and a CSV file.", "warning")
+            return redirect(url_for('.import_data'))
+        # uploads are spooled to disk by Werkzeug, so this reads line by line
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        try:
+            result = import_csv(kind, stream, current_user.mess_id, active_month.id if active_month else None)
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f"Import failed: {e}", "danger")
+            return redirect(url_for('.import_data'))
+        flash(f"Imported {result['imported']} {kind} row(s), "
+              f"{result['rejected_count']} rejected ({result['rows_per_second']:.0f} rows/s).")
+
+    return render_template('import_data.html', columns=IMPORT_COLUMNS,
+                           active_month=active_month, result=result)
+
+
+# ?month_id=<id> exports one month (default: the active month),
+# ?month_id=all exports the whole archive.
+@bp.route('/manager/export/<kind>.<fmt>')
+@login_required
+def export_data(kind, fmt):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    if kind not in EXPORT_COLUMNS or fmt not in ('csv', 'json'):
+        abort(404)
+
+    month_arg = request.args.get('month_id')
+    if month_arg == 'all':
+        month_id, label = None, 'all'
+    elif month_arg:
+        month = mess_month(int(month_arg)) if month_arg.isdigit() else None
+        if not month:
+            abort(404)
+        month_id, label = month.id, month.name
+    else:
+        active_month = get_active_month(current_user.mess_id)
+        if not active_month:
+            flash("No active month found.")
+            return redirect(url_for('.manage_months'))
+        month_id, label = active_month.id, active_month.name
+
+    rows = export_rows(kind, current_user.mess_id, month_id)
+    body = export_csv(kind, rows) if fmt == 'csv' else export_json(rows)
+    filename = secure_filename(f"{kind}-{label}.{fmt}")
+    return Response(stream_with_context(body),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/json',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+# ---------------- ADD DEPOSIT ----------------
+@bp.route('/manager/add_deposit', methods=['GET', 'POST'])
+@login_required
+def add_deposit():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found. Start a month first.")
+        return redirect(url_for('.manage_months'))
+
+    # ✅ Include all users (boarders + managers)
+    roster = get_roster(current_user.mess_id)
+    users = roster.users
+
+    if request.method == 'POST':
+        date_str = request.form['date']
+        user_id = int(request.form['user'])
+        if user_id not in roster.by_id:
+            abort(400)
+        try:
+            amount = parse_amount(request.form['amount'])
+        except ValueError as e:
+            flash(f"Deposit not saved: {e}.", "warning")
+            return redirect(url_for('.add_deposit'))
+
+        deposit = Deposit(
+            date=date.fromisoformat(date_str),
+            month_id=active_month.id,
+            boarder_id=user_id,  # same column for simplicity
+            amount=amount
+        )
+        db.session.add(deposit)
+        update_ledger('deposit', deposit.month_id, user_id, deposit=amount, day=deposit.date)
+        db.session.commit()
+        flash('Deposit added successfully!')
+        return redirect(url_for('.add_deposit'))
+
+    return render_template('add_deposit.html', users=users, active_month=active_month)
+
+
+
+# ---------------- ADD BAZAR ----------------
+@bp.route('/manager/add_bazar', methods=['GET', 'POST'])
+@login_required
+def add_bazar():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found. Start a month first.")
+        return redirect(url_for('.manage_months'))
+
+    if request.method == 'POST':
+        date_str = request.form['date']
+        description = request.form['description']
+        try:
+            cost = parse_amount(request.form['cost'])
+        except ValueError as e:
+            flash(f"Bazar entry not saved: {e}.", "warning")
+            return redirect(url_for('.add_bazar'))
+        bazar = Bazar(date=date.fromisoformat(date_str), month_id=active_month.id,
+                      description=description, cost=cost)
+        db.session.add(bazar)
+        update_ledger('bazar', bazar.month_id, bazar=cost, day=bazar.date, note=description)
+        db.session.commit()
+        flash('Bazar entry added successfully!')
+        return redirect(url_for('.add_bazar'))
+
+    return render_template('add_bazar.html', active_month=active_month)
+
+@bp.route('/manager/view_meals')
+@login_required
+def view_meals():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found.")
+        return redirect(url_for('.manage_months'))
+    meals, filters, next_args = keyset_page(Meal, active_month.id, Meal.user_id,
+                                            options=[db.joinedload(Meal.user)])
+    users = get_roster(current_user.mess_id).users
+    return render_template('view_meals.html', meals=meals, active_month=active_month,
+                           users=users, filters=filters, next_args=next_args)
+
+@bp.route('/manager/delete_meal/<int:id>')
+@login_required
+def delete_meal(id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    meal = mess_entry(Meal, id) or abort(404)
+    db.session.delete(meal)
+    update_ledger('meal', meal.month_id, meal.user_id, meals=-(meal.morning + meal.lunch + meal.dinner),
+                  day=meal.date)
+    db.session.commit()
+    flash('Meal deleted successfully!')
+    return redirect(url_for('.view_meals'))
+
+@bp.route('/manager/view_deposits')
+@login_required
+def view_deposits():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found.")
+        return redirect(url_for('.manage_months'))
+    deposits, filters, next_args = keyset_page(Deposit, active_month.id, Deposit.boarder_id,
+                                               options=[db.joinedload(Deposit.user)])
+    users = get_roster(current_user.mess_id).users
+    return render_template('view_deposits.html', deposits=deposits, active_month=active_month,
+                           users=users, filters=filters, next_args=next_args)
+
+@bp.route('/manager/delete_deposit/<int:id>')
+@login_required
+def delete_deposit(id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    deposit = mess_entry(Deposit, id) or abort(404)
+    db.session.delete(deposit)
+    update_ledger('deposit', deposit.month_id, deposit.boarder_id, deposit=-deposit.amount,
+                  day=deposit.date)
+    db.session.commit()
+    flash('Deposit deleted successfully!')
+    return redirect(url_for('.view_deposits'))
+
+@bp.route('/manager/view_bazar')
+@login_required
+def view_bazar():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    active_month = get_active_month(current_user.mess_id)
+    if not active_month:
+        flash("No active month found.")
+        return redirect(url_for('.manage_months'))
+    bazars, filters, next_args = keyset_page(Bazar, active_month.id)
+    return render_template('view_bazar.html', bazars=bazars, active_month=active_month,
+                           filters=filters, next_args=next_args)
+
+@bp.route('/manager/delete_bazar/<int:id>')
+@login_required
+def delete_bazar(id):
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    bazar = mess_entry(Bazar, id) or abort(404)
+    db.session.delete(bazar)
+    update_ledger('bazar', bazar.month_id, bazar=-bazar.cost, day=bazar.date, note=bazar.description)
+    db.session.commit()
+    flash('Bazar entry deleted successfully!')
+    return redirect(url_for('.view_bazar'))
+
+
+# ---------------- OFFLINE ENTRY ----------------
+# Meal, deposit and bazar forms that work without a connection: entries are
+# queued on the phone by static/offline.js and posted to /api/sync.
+@bp.route('/manager/entry')
+@login_required
+def offline_entry():
+    if current_user.role != 'manager':
+        return redirect(url_for('.index'))
+    return render_template('offline_entry.html', active_month=get_active_month(current_user.mess_id),
+                           users=get_roster(current_user.mess_id).users)
+
+
+# Body: {"entries": [{"client_id": "...", "kind": "meals", "date": "2025-01-31",
+# "user": 3, "morning": 1, "lunch": 1, "dinner": 0, "month": 7}, ...]} with the
+# CSV import columns per kind. Safe to resend: saved ids come back as duplicates.
+@bp.route('/api/sync', methods=['POST'])
+@login_required
+def api_sync():
+    if current_user.role != 'manager':
+        return jsonify(error="Access denied!"), 403
+    payload = request.get_json(silent=True)
+    entries = payload.get('entries') if isinstance(payload, dict) else None
+    if not isinstance(entries, list):
+        return jsonify(error='Expected {"entries": [...]}.'), 400
+    if len(entries) > MAX_SYNC_ENTRIES:
+        return jsonify(error=f"At most {MAX_SYNC_ENTRIES} entries per request."), 413
+    active_month = get_active_month(current_user.mess_id)
+    try:
+        results = sync_entries(entries, current_user.id, current_user.mess_id,
+                               active_month.id if active_month else None)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(error="These entries are being saved by another request; retry."), 409
+    return jsonify(results=results)
+
+
+# Served from the root so it controls every page. The cache is named after
+# the static files' fingerprint, so a deploy that changes them also makes
+# phones fetch fresh copies.
+@bp.route('/sw.js')
+def service_worker():
+    assets = current_app.extensions['assets']
+    precache = [BOOTSTRAP_CSS] + [url_for('static', filename=name) for name in assets.files()]
+    body = render_template('sw.js', version=assets.version(), precache=precache,
+                           entry_page=url_for('.offline_entry'), logout=url_for('.logout'),
+                           static_prefix=url_for('static', filename=''))
+    response = Response(body, mimetype='text/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response